@@ -0,0 +1,170 @@
+# benchmark/fetch_check.py
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.benchmark.synthetic_prescriptions import generate_dataset
+from src.runtime.http_fetch import ImageFetcher
+
+class StandInImageHandler(BaseHTTPRequestHandler):
+    """Serves files from a directory, with ETags and If-None-Match handling"""
+
+    def __init__(self, *args, root=None, send_etag=True, counts=None, **kwargs):
+        self.root = root
+        self.send_etag = send_etag
+        self.counts = counts
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        path = os.path.join(self.root, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self._reply(404)
+            return
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        if self.send_etag and self.headers.get("If-None-Match") == etag:
+            self._reply(304)
+            return
+
+        self._reply(200, data, etag if self.send_etag else None)
+
+    def _reply(self, status, data=b"", etag=None):
+        """Send a response and count it by status"""
+        self.counts[status] = self.counts.get(status, 0) + 1
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(root, send_etag=True):
+    """
+    Start a stand-in image server on a free local port
+
+    Returns:
+        Tuple of (server, base URL, response counts by status)
+    """
+    counts = {}
+    handler = partial(StandInImageHandler, root=root, send_etag=send_etag, counts=counts)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", counts
+
+def fetch_all(cache_dir, urls, max_workers):
+    """
+    Run one prefetching pass with a fresh fetcher, as a new run would
+
+    Returns:
+        Tuple of (list of (url, path, error) in yield order, fetcher statistics)
+    """
+    fetcher = ImageFetcher(cache_dir, max_workers=max_workers, retries=0)
+    try:
+        results = list(fetcher.iter_prefetched(urls, depth=max_workers))
+    finally:
+        fetcher.close()
+    return results, fetcher.stats
+
+def check_fetching(image_paths, work_dir, max_workers=4):
+    """
+    Check ImageFetcher against stand-in servers with and without ETags
+
+    Covers input ordering, failed fetches, cached bytes matching the source,
+    304 revalidation of unchanged images, re-downloading changed images, and
+    serving from the cache without a request when the server sends no ETag.
+
+    Args:
+        image_paths: Images to serve
+        work_dir: Directory for served copies and fetch caches
+        max_workers: Concurrent fetches
+
+    Returns:
+        Dictionary mapping check names to whether they passed
+    """
+    serve_dir = os.path.join(work_dir, "served")
+    os.makedirs(serve_dir, exist_ok=True)
+    names = []
+    for path in image_paths:
+        name = os.path.basename(path)
+        with open(path, 'rb') as src, open(os.path.join(serve_dir, name), 'wb') as dst:
+            dst.write(src.read())
+        names.append(name)
+
+    checks = {}
+    server, base_url, counts = start_server(serve_dir)
+    try:
+        urls = [f"{base_url}/{name}" for name in names]
+        urls.insert(len(urls) // 2, f"{base_url}/missing.png")
+        cache_dir = os.path.join(work_dir, "cache_etag")
+
+        results, stats = fetch_all(cache_dir, urls, max_workers)
+        checks["input_order"] = [url for url, _, _ in results] == urls
+        checks["missing_url_fails"] = all((path is None) == url.endswith("/missing.png")
+                                          for url, path, _ in results)
+        checks["cached_bytes_match"] = all(
+            open(path, 'rb').read() == open(os.path.join(serve_dir, os.path.basename(url)), 'rb').read()
+            for url, path, _ in results if path is not None)
+        checks["first_pass_downloads"] = stats["downloaded"] == len(names) and stats["revalidated"] == 0
+
+        counts.clear()
+        _, stats = fetch_all(cache_dir, urls, max_workers)
+        checks["second_pass_revalidates"] = (stats["downloaded"] == 0 and stats["revalidated"] == len(names)
+                                             and counts.get(304) == len(names) and 200 not in counts)
+
+        with open(os.path.join(serve_dir, names[0]), 'ab') as f:
+            f.write(b"\0")
+        _, stats = fetch_all(cache_dir, urls, max_workers)
+        checks["changed_image_redownloaded"] = stats["downloaded"] == 1 and stats["revalidated"] == len(names) - 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    server, base_url, counts = start_server(serve_dir, send_etag=False)
+    try:
+        urls = [f"{base_url}/{name}" for name in names]
+        cache_dir = os.path.join(work_dir, "cache_no_etag")
+        fetch_all(cache_dir, urls, max_workers)
+        counts.clear()
+        _, stats = fetch_all(cache_dir, urls, max_workers)
+        checks["no_etag_served_from_cache"] = stats["downloaded"] == 0 and not counts
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return checks
+
+def main():
+    """URL fetching check entry point"""
+    parser = argparse.ArgumentParser(description="Check URL fetching against a local stand-in image server")
+    parser.add_argument("--work_dir", type=str, help="Directory for synthetic images and fetch caches "
+                                                     "(defaults to a temporary directory)")
+    parser.add_argument("--num_images", type=int, default=6, help="Number of images to serve")
+    parser.add_argument("--fetch_workers", type=int, default=4, help="Concurrent fetches")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        image_paths, _ = generate_dataset(os.path.join(work_dir, "images"), args.num_images)
+        checks = check_fetching(image_paths, work_dir, args.fetch_workers)
+
+    print(json.dumps(checks, indent=2))
+    failed = [name for name, passed in checks.items() if not passed]
+    if failed:
+        print(f"Failed checks: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"All {len(checks)} fetch checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# benchmark/run_benchmark.py
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+from src.preprocessing.image_enhancement import enhance_prescription, enhance_image, segment_regions
+from src.preprocessing.deduplication import DuplicateIndex, compare_content, hamming_distance, names_match
+from src.model.prompt_templates import get_extraction_prompt, get_verification_prompt
+from src.postprocessing.json_formatter import JsonFormatter
+from src.postprocessing.medical_validator import MedicalValidator
+from src.postprocessing.verification_policy import VerificationPolicy
+from src.evaluation.metrics import PrescriptionEvaluator
+from src.benchmark.synthetic_prescriptions import (generate_dataset, generate_ground_truth, render_prescription,
+                                                    rescan_prescription, vary_prescription)
+from src.benchmark.stub_model import StubLlavaExtractor
+from src.model.cascade import ModelCascade
+from src.model.field_reextraction import FieldReextractor
+from src.instrumentation.tracing import Tracer
+from src.main import process_prescription
+
+DEDUP_VARIANT_FIELDS = ["patient_name", "patient_age", "dosage", "frequency"]
+
+def summarize_timings(samples):
+    """
+    Summarize a list of durations in seconds
+
+    Args:
+        samples: List of durations
+
+    Returns:
+        Dictionary of summary statistics
+    """
+    if not samples:
+        return {"count": 0}
+
+    values = np.array(samples, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "total_s": float(values.sum()),
+        "mean_s": float(values.mean()),
+        "median_s": float(np.median(values)),
+        "p95_s": float(np.percentile(values, 95)),
+        "min_s": float(values.min()),
+        "max_s": float(values.max())
+    }
+
+def summarize_scores(scores):
+    """Summarize a list of similarity scores"""
+    if not scores:
+        return {"count": 0}
+
+    values = np.array(scores, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "min": float(values.min()),
+        "p5": float(np.percentile(values, 5)),
+        "median": float(np.median(values)),
+        "max": float(values.max())
+    }
+
+def timed(timings, stage, func, *args, **kwargs):
+    """Call func and append its wall time to timings[stage]"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+def environment_info():
+    """Collect details needed to compare results between commits and machines"""
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count()
+    }
+
+def benchmark_stages(image_paths, ground_truth, model, formatter, validator, evaluator):
+    """
+    Time each pipeline stage in isolation
+
+    Returns:
+        Tuple of (stage timing summaries, predictions)
+    """
+    timings = {}
+    predictions = []
+
+    for image_path in image_paths:
+        enhanced = timed(timings, "enhance_prescription", enhance_prescription, image_path)
+        timed(timings, "segment_regions", segment_regions, enhanced)
+
+        raw_response = timed(timings, "model_extraction", model.extract_prescription_data,
+                             image_path, get_extraction_prompt())
+        extracted = timed(timings, "format_response", formatter.format_response, raw_response)
+
+        verification_prompt = get_verification_prompt(json.dumps(extracted, indent=2))
+        verification_response = timed(timings, "model_verification", model.extract_prescription_data,
+                                      image_path, verification_prompt)
+        verified = timed(timings, "format_response", formatter.format_response, verification_response)
+        final = verified if "error" not in verified else extracted
+
+        standardized = timed(timings, "standardize_medical_terms", formatter.standardize_medical_terms, final)
+        validated = timed(timings, "validate_prescription", validator.validate_prescription, standardized)
+        predictions.append(validated)
+
+    timed(timings, "evaluation", evaluator.evaluate_dataset, predictions, ground_truth)
+
+    return {stage: summarize_timings(samples) for stage, samples in timings.items()}, predictions
+
+def benchmark_end_to_end(image_paths, ground_truth, model, formatter, validator, evaluator, repeats=1,
+                         verification_policy=None, cascade=None, field_reextractor=None):
+    """
+    Time process_prescription over the whole dataset
+
+    Returns:
+        Dictionary with latency, throughput and accuracy
+    """
+    timings = {}
+    results = []
+    tracer = Tracer()
+    for stub in ([cascade.small_model, cascade.large_model] if cascade is not None else [model]):
+        stub.calls = 0
+        stub.generated_tokens = 0
+        stub.model_s = 0.0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        results = [
+            timed(timings, "process_prescription", process_prescription, image_path, model, formatter, validator,
+                  tracer=tracer, verification_policy=verification_policy, cascade=cascade,
+                  field_reextractor=field_reextractor)
+            for image_path in image_paths
+        ]
+    total_time = time.perf_counter() - start
+
+    metrics = evaluator.evaluate_dataset(results, ground_truth)
+    processed = len(image_paths) * repeats
+    stubs = [cascade.small_model, cascade.large_model] if cascade is not None else [model]
+    model_calls = sum(stub.calls for stub in stubs)
+    generated_tokens = sum(stub.generated_tokens for stub in stubs)
+    model_s = sum(stub.model_s for stub in stubs)
+    verified = sum(1 for r in results if r['processing']['verification'] == "run")
+    field_checked = sum(1 for r in results if r['processing']['verification'] == "fields")
+
+    return {
+        "latency": summarize_timings(timings.get("process_prescription", [])),
+        "total_s": total_time,
+        "prescriptions_per_s": processed / total_time if total_time > 0 else 0.0,
+        "model_calls": model_calls,
+        "generated_tokens": generated_tokens,
+        "model_s": model_s,
+        "verification_rate": verified / len(results) if results else 0.0,
+        "field_reextraction_rate": field_checked / len(results) if results else 0.0,
+        "overall_score": float(metrics["overall_score"]),
+        "trace_summary": tracer.summary(),
+        "cascade": ({**cascade.stats, "escalation_rate": cascade.escalation_rate(),
+                     "large_model_calls": cascade.large_model.calls,
+                     "large_model_tokens": cascade.large_model.generated_tokens}
+                    if cascade is not None else None)
+    }
+
+def compare_verification_gating(always, gated):
+    """
+    Compare an always-verify run with a confidence-gated run
+
+    Args:
+        always: benchmark_end_to_end result without a verification policy
+        gated: benchmark_end_to_end result with a verification policy
+
+    Latency saved is measured on model time only; image enhancement and
+    post-processing cost the same in both runs and would drown out the
+    difference.
+
+    Returns:
+        Dictionary with model time saved and accuracy delta
+    """
+    saved = always["model_s"] - gated["model_s"]
+    return {
+        "model_time_saved_s": saved,
+        "model_time_saved_pct": 100 * saved / always["model_s"] if always["model_s"] > 0 else 0.0,
+        "model_calls_saved": always["model_calls"] - gated["model_calls"],
+        "generated_tokens_saved": always["generated_tokens"] - gated["generated_tokens"],
+        "verification_rate": gated["verification_rate"],
+        "accuracy_delta": gated["overall_score"] - always["overall_score"]
+    }
+
+def benchmark_deduplication(num_sheets, seed=0, min_similarity=0.94, candidate_distance=96, rescans=2):
+    """
+    Calibrate duplicate detection on re-scans and same-template prescriptions
+
+    Each synthetic sheet is re-photographed several times, and re-rendered with
+    the same layout and handwriting but one field changed (patient name, age,
+    first dosage or last frequency). Re-scans must be reused; the variants and
+    other sheets must not be, whatever the hash says.
+
+    Args:
+        num_sheets: Number of synthetic prescriptions
+        seed: Seed for the records, renders and re-scans
+        min_similarity: Text match threshold to evaluate
+        candidate_distance: Layout hash search radius to evaluate
+        rescans: Re-scans per sheet
+
+    Returns:
+        Dictionary with score distributions, recall and false reuse at the
+        threshold, and the lowest threshold that reuses no variant
+    """
+    index = DuplicateIndex(min_similarity=min_similarity, candidate_distance=candidate_distance)
+    timings = {}
+    rescan_scores, rescan_distances = [], []
+    variant_scores = {field: [] for field in DEDUP_VARIANT_FIELDS}
+    variant_names = []
+    other_scores, other_distances = [], []
+
+    signatures = []
+    for sheet in range(num_sheets):
+        rng = random.Random(seed * 100003 + sheet)
+        record = generate_ground_truth(rng)
+        layout_seed = rng.randint(0, 2**31 - 1)
+        image = render_prescription(record, random.Random(layout_seed))
+        original = timed(timings, "signature", index.compute_signature, enhance_image(image))
+        signatures.append(original)
+
+        for _ in range(rescans):
+            rescanned = index.compute_signature(enhance_image(rescan_prescription(image, rng)))
+            rescan_scores.append(timed(timings, "compare", compare_content,
+                                       original["content"], rescanned["content"]))
+            rescan_distances.append(hamming_distance(original["hash"], rescanned["hash"]))
+
+        for field in DEDUP_VARIANT_FIELDS:
+            varied = vary_prescription(record, field, rng)
+            # Same layout seed: same template, handwriting jitter and page noise
+            variant = index.compute_signature(enhance_image(render_prescription(varied, random.Random(layout_seed))))
+            score = timed(timings, "compare", compare_content, original["content"], variant["content"])
+            variant_scores[field].append(score)
+            variant_names.append((score, record["patient_name"], varied["patient_name"]))
+
+    for sheet in range(1, num_sheets):
+        other_scores.append(compare_content(signatures[sheet - 1]["content"], signatures[sheet]["content"]))
+        other_distances.extend(hamming_distance(signatures[sheet]["hash"], earlier["hash"])
+                               for earlier in signatures[:sheet])
+
+    all_variants = [score for scores in variant_scores.values() for score in scores]
+    negatives = all_variants + other_scores
+    false_reuse = sum(1 for score in negatives if score >= min_similarity)
+    # The patient check catches accepted variants whose name differs
+    after_patient_check = (sum(1 for score, name, varied in variant_names
+                               if score >= min_similarity and names_match(name, varied))
+                           + sum(1 for score in other_scores if score >= min_similarity))
+    recommended = round(float(np.ceil((max(negatives, default=0.0) + 0.01) * 100) / 100), 2)
+
+    return {
+        "sheets": num_sheets,
+        "rescan_scores": summarize_scores(rescan_scores),
+        "variant_scores": {field: summarize_scores(scores) for field, scores in variant_scores.items()},
+        "other_prescription_scores": summarize_scores(other_scores),
+        "min_similarity": min_similarity,
+        "rescan_recall": (sum(1 for score in rescan_scores if score >= min_similarity) / len(rescan_scores)
+                          if rescan_scores else 0.0),
+        "false_reuse": false_reuse,
+        "false_reuse_after_patient_check": after_patient_check,
+        "recommended_min_similarity": recommended,
+        "rescan_recall_at_recommended": (sum(1 for score in rescan_scores if score >= recommended)
+                                         / len(rescan_scores) if rescan_scores else 0.0),
+        "candidate_distance": candidate_distance,
+        "candidate_recall": (sum(1 for d in rescan_distances if d <= candidate_distance) / len(rescan_distances)
+                             if rescan_distances else 0.0),
+        "other_prescriptions_in_radius": (sum(1 for d in other_distances if d <= candidate_distance)
+                                          / len(other_distances) if other_distances else 0.0),
+        "timings": {stage: summarize_timings(samples) for stage, samples in timings.items()}
+    }
+
+def main():
+    """Benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Prescription pipeline benchmark")
+    parser.add_argument("--work_dir", type=str, default="benchmark_data", help="Directory for synthetic images")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Path to write JSON results")
+    parser.add_argument("--num_samples", type=int, default=20, help="Number of synthetic prescriptions")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for data generation and the stub model")
+    parser.add_argument("--repeats", type=int, default=1, help="Number of end-to-end passes over the dataset")
+    parser.add_argument("--verify_threshold", type=float, default=0.9,
+                        help="Validator confidence threshold for the gated verification run")
+    parser.add_argument("--dedup_sheets", type=int, default=10,
+                        help="Synthetic sheets for the duplicate detection calibration (0 to skip)")
+    parser.add_argument("--dedup_similarity", type=float, default=0.94,
+                        help="Duplicate text match threshold to evaluate")
+    parser.add_argument("--seconds_per_token", type=float, default=0.002,
+                        help="Simulated generation cost per token for the stub model (0 for no delay)")
+    args = parser.parse_args()
+
+    image_paths, ground_truth = generate_dataset(args.work_dir, args.num_samples, args.seed)
+    gt_by_name = {os.path.basename(p): gt for p, gt in zip(image_paths, ground_truth)}
+
+    model = StubLlavaExtractor(gt_by_name, seconds_per_token=args.seconds_per_token, seed=args.seed)
+    formatter = JsonFormatter(medical_terms_path=os.path.join(args.work_dir, "medical_terms.json"))
+    validator = MedicalValidator()
+    evaluator = PrescriptionEvaluator()
+
+    stages, _ = benchmark_stages(image_paths, ground_truth, model, formatter, validator, evaluator)
+    end_to_end = benchmark_end_to_end(image_paths, ground_truth, model, formatter, validator, evaluator,
+                                      args.repeats)
+    policy = VerificationPolicy(validator, confidence_threshold=args.verify_threshold)
+    gated = benchmark_end_to_end(image_paths, ground_truth, model, formatter, validator, evaluator,
+                                 args.repeats, verification_policy=policy)
+    fields = benchmark_end_to_end(image_paths, ground_truth, model, formatter, validator, evaluator,
+                                  args.repeats, verification_policy=policy,
+                                  field_reextractor=FieldReextractor(formatter))
+
+    # Cascade: a faster, less accurate stub in front of the large-model stub
+    small_model = StubLlavaExtractor(gt_by_name, error_rate=0.15, verification_error_rate=0.1,
+                                     seconds_per_token=args.seconds_per_token / 4, seed=args.seed + 1)
+    large_model = StubLlavaExtractor(gt_by_name, error_rate=0.05, verification_error_rate=0.02,
+                                     seconds_per_token=args.seconds_per_token, seed=args.seed)
+    cascade = ModelCascade(small_model, large_model, VerificationPolicy(validator), FieldReextractor(formatter))
+    cascaded = benchmark_end_to_end(image_paths, ground_truth, large_model, formatter, validator, evaluator,
+                                    args.repeats, cascade=cascade)
+
+    report = {
+        "config": vars(args),
+        "environment": environment_info(),
+        "stages": stages,
+        "end_to_end": end_to_end,
+        "end_to_end_gated": gated,
+        "verification_gating": compare_verification_gating(end_to_end, gated),
+        "end_to_end_fields": fields,
+        "field_reextraction": compare_verification_gating(gated, fields),
+        "end_to_end_cascade": cascaded,
+        "deduplication": (benchmark_deduplication(args.dedup_sheets, args.seed, args.dedup_similarity)
+                          if args.dedup_sheets > 0 else None)
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Benchmark results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# benchmark/speculative_decoding.py
+
+import os
+import json
+import argparse
+
+from src.model.llava_interface import LlavaExtractor
+from src.model.prompt_templates import get_extraction_prompt, get_verification_prompt
+
+def run_generation(model, image_path, prompt, speculative):
+    """
+    Run one generation with speculation switched on or off
+
+    Args:
+        model: LlavaExtractor configured with a draft model or prompt lookup
+        image_path: Prescription image
+        prompt: Instruction prompt
+        speculative: Draft tokens ahead of the model
+
+    Returns:
+        Tuple of (response text, speculation statistics for this generation)
+    """
+    draft_model, prompt_lookup_tokens = model.draft_model, model.prompt_lookup_tokens
+    if not speculative:
+        model.draft_model, model.prompt_lookup_tokens = None, None
+
+    before = dict(model.speculation_stats)
+    try:
+        response = model.extract_prescription_data(image_path, prompt)
+    finally:
+        model.draft_model, model.prompt_lookup_tokens = draft_model, prompt_lookup_tokens
+
+    stats = {key: model.speculation_stats[key] - before[key] for key in before}
+    return response, stats
+
+def benchmark_speculative_decoding(model, image_paths):
+    """
+    Compare greedy and speculative decoding on extraction and verification prompts
+
+    The verification prompt embeds the greedy extraction output, the case
+    where prompt lookup can copy long spans. The model should be built with
+    prefix_cache=False: speculative runs bypass the prefix cache, so a cached
+    greedy run would skip part of its prefill and could decode differently.
+
+    Args:
+        model: LlavaExtractor configured with a draft model or prompt lookup
+        image_paths: Prescription images
+
+    Returns:
+        Report with per-prompt-kind speedup, acceptance and output mismatches
+    """
+    totals = {kind: {"greedy_s": 0.0, "speculative_s": 0.0, "generated_tokens": 0,
+                     "target_forwards": 0, "draft_forwards": 0, "mismatches": 0}
+              for kind in ("extraction", "verification")}
+
+    for image_path in image_paths:
+        extraction = None
+        for kind in ("extraction", "verification"):
+            prompt = get_extraction_prompt() if kind == "extraction" else get_verification_prompt(extraction)
+            greedy, greedy_stats = run_generation(model, image_path, prompt, speculative=False)
+            speculative, spec_stats = run_generation(model, image_path, prompt, speculative=True)
+
+            total = totals[kind]
+            total["greedy_s"] += greedy_stats["generate_s"]
+            total["speculative_s"] += spec_stats["generate_s"]
+            total["generated_tokens"] += spec_stats["generated_tokens"]
+            total["target_forwards"] += spec_stats["target_forwards"]
+            total["draft_forwards"] += spec_stats["draft_forwards"]
+            if speculative != greedy:
+                total["mismatches"] += 1
+                print(f"Warning: Speculative output differs from greedy for {image_path} ({kind})")
+
+            if kind == "extraction":
+                extraction = greedy
+
+    for total in totals.values():
+        accepted = max(total["generated_tokens"] - total["target_forwards"], 0)
+        total["speedup"] = total["greedy_s"] / total["speculative_s"] if total["speculative_s"] else 0.0
+        total["tokens_per_target_forward"] = (total["generated_tokens"] / total["target_forwards"]
+                                              if total["target_forwards"] else 0.0)
+        total["acceptance_rate"] = (accepted / total["draft_forwards"]
+                                    if model.draft_model is not None and total["draft_forwards"] else None)
+
+    return totals
+
+def main():
+    """Speculative decoding benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Compare greedy and speculative LLaVA decoding")
+    parser.add_argument("--input_dir", type=str, required=True, help="Directory containing prescription images")
+    parser.add_argument("--model_name", type=str, default="llava-hf/llava-1.5-13b-hf", help="LLaVA model name")
+    parser.add_argument("--draft_model", type=str, help="Draft model with the same tokenizer (optional)")
+    parser.add_argument("--num_draft_tokens", type=int, help="Initial number of tokens drafted per step")
+    parser.add_argument("--prompt_lookup_tokens", type=int, default=10,
+                        help="Prompt lookup draft length, used when no --draft_model is given")
+    parser.add_argument("--num_images", type=int, default=5, help="Number of images to run")
+    parser.add_argument("--output", type=str, default="speculative_results.json", help="Path to write JSON results")
+    args = parser.parse_args()
+
+    image_paths = sorted(
+        os.path.join(args.input_dir, f)
+        for f in os.listdir(args.input_dir)
+        if f.lower().endswith(('.png', '.jpg', '.jpeg'))
+    )[:args.num_images]
+
+    # Both sides prefill the full prompt, so generate_s and outputs are comparable
+    model = LlavaExtractor(
+        model_name=args.model_name,
+        prefix_cache=False,
+        draft_model_name=args.draft_model,
+        num_draft_tokens=args.num_draft_tokens,
+        prompt_lookup_tokens=None if args.draft_model else args.prompt_lookup_tokens
+    )
+    report = {
+        "config": vars(args),
+        "results": benchmark_speculative_decoding(model, image_paths)
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for kind, result in report["results"].items():
+        acceptance = (f", {result['acceptance_rate']:.1%} accepted"
+                      if result["acceptance_rate"] is not None else "")
+        print(f"{kind}: {result['speedup']:.2f}x speedup, "
+              f"{result['tokens_per_target_forward']:.2f} tokens per model pass{acceptance}, "
+              f"{result['mismatches']} mismatches")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# benchmark/synthetic_prescriptions.py
+
+import os
+import copy
+import json
+import random
+import cv2
+import numpy as np
+
+PATIENT_NAMES = [
+    "John Smith", "Maria Garcia", "Wei Chen", "Aisha Khan", "Robert Brown",
+    "Priya Sharma", "David Miller", "Fatima Ali", "James Wilson", "Elena Petrova"
+]
+
+DOCTOR_NAMES = [
+    "Dr. Sarah Johnson", "Dr. Rajesh Kumar", "Dr. Emily Davis", "Dr. Ahmed Hassan", "Dr. Laura White"
+]
+
+CREDENTIALS = ["MBBS, MD", "MD, Internal Medicine", "MBBS, DNB", "MD, Family Medicine"]
+
+CLINICS = ["City General Hospital", "Sunrise Clinic", "Lakeside Medical Center", "Green Valley Hospital"]
+
+DIAGNOSES = [
+    "Hypertension", "Type 2 Diabetes", "Acute Bronchitis", "Migraine",
+    "Urinary Tract Infection", "Seasonal Allergies", "Gastritis"
+]
+
+MEDICATIONS = [
+    {"name": "Amoxicillin", "dosage": "500mg", "route": "oral"},
+    {"name": "Metformin", "dosage": "850mg", "route": "oral"},
+    {"name": "Lisinopril", "dosage": "10mg", "route": "oral"},
+    {"name": "Ibuprofen", "dosage": "400mg", "route": "oral"},
+    {"name": "Cetirizine", "dosage": "10mg", "route": "oral"},
+    {"name": "Omeprazole", "dosage": "20mg", "route": "oral"},
+    {"name": "Salbutamol", "dosage": "2 puffs", "route": "inhalation"},
+    {"name": "Hydrocortisone", "dosage": "1 application", "route": "topical"},
+    {"name": "Paracetamol", "dosage": "1 tablet", "route": "oral"},
+    {"name": "Ciprofloxacin", "dosage": "250mg", "route": "oral"}
+]
+
+FREQUENCIES = ["once daily", "twice daily", "three times daily", "every 8 hours", "at bedtime", "as needed"]
+
+DURATIONS = ["5 days", "7 days", "10 days", "2 weeks", "1 month"]
+
+INSTRUCTIONS = ["after meals", "before breakfast", "with plenty of water", None]
+
+def generate_ground_truth(rng, max_medications=4):
+    """
+    Generate a random but plausible prescription record
+
+    Args:
+        rng: random.Random instance used for all choices
+        max_medications: Maximum number of medications on the prescription
+
+    Returns:
+        Dictionary in the same schema as the extraction prompt
+    """
+    medications = []
+    for med in rng.sample(MEDICATIONS, rng.randint(1, max_medications)):
+        medications.append({
+            "name": med["name"],
+            "dosage": med["dosage"],
+            "route": med["route"],
+            "frequency": rng.choice(FREQUENCIES),
+            "duration": rng.choice(DURATIONS),
+            "special_instructions": rng.choice(INSTRUCTIONS)
+        })
+
+    return {
+        "patient_name": rng.choice(PATIENT_NAMES),
+        "patient_age": rng.randint(4, 90),
+        "patient_gender": rng.choice(["Male", "Female"]),
+        "medication_list": medications,
+        "diagnosis": rng.choice(DIAGNOSES),
+        "doctor_name": rng.choice(DOCTOR_NAMES),
+        "doctor_credentials": rng.choice(CREDENTIALS),
+        "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "hospital/clinic": rng.choice(CLINICS)
+    }
+
+def prescription_lines(record):
+    """
+    Lay out a prescription record as the lines a doctor would write
+    """
+    lines = [
+        record["hospital/clinic"],
+        f"{record['doctor_name']}  ({record['doctor_credentials']})",
+        f"Date: {record['date']}",
+        f"Patient: {record['patient_name']}  Age: {record['patient_age']}  {record['patient_gender']}",
+        f"Dx: {record['diagnosis']}",
+        "Rx"
+    ]
+    for i, med in enumerate(record["medication_list"]):
+        lines.append(f"{i+1}. {med['name']} {med['dosage']} {med['route']}")
+        detail = f"   {med['frequency']} x {med['duration']}"
+        if med["special_instructions"]:
+            detail += f", {med['special_instructions']}"
+        lines.append(detail)
+
+    return lines
+
+def render_prescription(record, rng, width=1200, line_height=70):
+    """
+    Render a prescription record as a handwritten-style scan
+
+    Args:
+        record: Prescription record from generate_ground_truth
+        rng: random.Random instance used for jitter and noise
+        width: Width of the generated image in pixels
+        line_height: Vertical spacing between lines in pixels
+
+    Returns:
+        BGR image as a numpy array
+    """
+    lines = prescription_lines(record)
+    height = line_height * (len(lines) + 2)
+
+    # Off-white paper with slight colour variation
+    paper = np.full((height, width, 3), 235 + rng.randint(0, 15), dtype=np.uint8)
+
+    ink = (rng.randint(60, 120), rng.randint(20, 60), rng.randint(0, 30))
+    y = line_height
+    for line in lines:
+        x = 40 + rng.randint(-10, 10)
+        scale = 1.0 + rng.uniform(-0.1, 0.1)
+        cv2.putText(paper, line, (x, y + rng.randint(-5, 5)), cv2.FONT_HERSHEY_SCRIPT_SIMPLEX,
+                    scale, ink, thickness=2, lineType=cv2.LINE_AA)
+        y += line_height
+
+    # Slight rotation to mimic a handheld photograph
+    angle = rng.uniform(-2.0, 2.0)
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    paper = cv2.warpAffine(paper, matrix, (width, height), borderValue=(240, 240, 240))
+
+    # Sensor noise and blur
+    np_rng = np.random.default_rng(rng.randint(0, 2**31 - 1))
+    noise = np_rng.normal(0, 8, paper.shape)
+    paper = np.clip(paper.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    paper = cv2.GaussianBlur(paper, (3, 3), 0)
+
+    return paper
+
+def rescan_prescription(image, rng):
+    """
+    Simulate photographing the same prescription sheet again
+
+    Args:
+        image: Rendered prescription from render_prescription
+        rng: random.Random instance used for framing, lighting and noise
+
+    Returns:
+        BGR image as a numpy array, same size as the input
+    """
+    height, width = image.shape[:2]
+
+    # Different framing: rotation, distance and position of the sheet
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-3.0, 3.0), rng.uniform(0.95, 1.05))
+    matrix[0, 2] += rng.uniform(-40, 40)
+    matrix[1, 2] += rng.uniform(-40, 40)
+    rescanned = cv2.warpAffine(image, matrix, (width, height), borderValue=(240, 240, 240))
+
+    # Different exposure and sensor noise
+    rescanned = rescanned.astype(np.float32) * rng.uniform(0.8, 1.15) + rng.uniform(-20, 20)
+    np_rng = np.random.default_rng(rng.randint(0, 2**31 - 1))
+    rescanned = np.clip(rescanned + np_rng.normal(0, rng.uniform(2, 6), rescanned.shape), 0, 255).astype(np.uint8)
+    if rng.random() < 0.5:
+        rescanned = cv2.GaussianBlur(rescanned, (3, 3), 0)
+
+    return rescanned
+
+def vary_prescription(record, field, rng):
+    """
+    Change one field of a prescription record, as a different prescription
+    written on the same template would
+
+    Args:
+        record: Prescription record from generate_ground_truth
+        field: One of patient_name, patient_age, dosage or frequency
+        rng: random.Random instance used for the replacement value
+
+    Returns:
+        Modified copy of the record
+    """
+    varied = copy.deepcopy(record)
+    if field == "patient_name":
+        varied["patient_name"] = rng.choice([n for n in PATIENT_NAMES if n != record["patient_name"]])
+    elif field == "patient_age":
+        # A single digit is the smallest change a reader must not miss
+        varied["patient_age"] = record["patient_age"] + 1 if record["patient_age"] < 90 else 89
+    elif field == "dosage":
+        medication = varied["medication_list"][0]
+        medication["dosage"] = rng.choice([m["dosage"] for m in MEDICATIONS if m["dosage"] != medication["dosage"]])
+    elif field == "frequency":
+        medication = varied["medication_list"][-1]
+        medication["frequency"] = rng.choice([f for f in FREQUENCIES if f != medication["frequency"]])
+    else:
+        raise ValueError(f"Unknown field to vary: {field}")
+    return varied
+
+def generate_dataset(output_dir, num_samples=20, seed=0):
+    """
+    Generate synthetic prescription images with matching ground truth
+
+    Args:
+        output_dir: Directory to write images and ground_truth.json into
+        num_samples: Number of prescriptions to generate
+        seed: Seed for the random generator, so runs are reproducible
+
+    Returns:
+        Tuple of (list of image paths, list of ground truth records)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+
+    image_paths = []
+    ground_truth = []
+    for i in range(num_samples):
+        record = generate_ground_truth(rng)
+        image = render_prescription(record, rng)
+
+        image_path = os.path.join(output_dir, f"prescription_{i:04d}.png")
+        cv2.imwrite(image_path, image)
+
+        image_paths.append(image_path)
+        ground_truth.append(record)
+
+    with open(os.path.join(output_dir, "ground_truth.json"), 'w') as f:
+        json.dump(ground_truth, f, indent=2)
+
+    # Terminology file so standardize_medical_terms has real work to do
+    with open(os.path.join(output_dir, "medical_terms.json"), 'w') as f:
+        json.dump({"drug_names": [med["name"] for med in MEDICATIONS]}, f, indent=2)
+
+    return image_paths, ground_truth
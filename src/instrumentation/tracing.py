@@ -0,0 +1,344 @@
+# instrumentation/tracing.py
+
+import os
+import sys
+import json
+import time
+import threading
+import resource
+
+def peak_rss_mb():
+    """Peak resident set size over the whole lifetime of this process in megabytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+def current_rss_mb():
+    """
+    Current resident set size of this process in megabytes
+
+    Read from /proc where available; elsewhere the lifetime peak is the best
+    figure the standard library offers.
+    """
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def _cuda():
+    """
+    Return torch.cuda if torch is already imported and a GPU is available
+
+    Tracing never imports torch by itself, so it pulls in no heavy
+    dependencies. On CPU-only runs tensor memory is part of the RSS figures.
+    """
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda
+
+def tensor_memory_mb():
+    """
+    Current accelerator tensor memory and its peak since the last reset, in megabytes
+
+    Returns:
+        Tuple of (current, peak), or (None, None) without a GPU
+    """
+    cuda = _cuda()
+    if cuda is None:
+        return None, None
+    return (cuda.memory_allocated() / (1024 * 1024),
+            cuda.max_memory_allocated() / (1024 * 1024))
+
+def reset_tensor_peak():
+    """Restart the accelerator peak-memory counter"""
+    cuda = _cuda()
+    if cuda is not None:
+        cuda.reset_peak_memory_stats()
+
+class RssPeakSampler:
+    def __init__(self, interval_s=0.01):
+        """
+        Samples current RSS on a background thread to find the peak over a region
+
+        Unlike the lifetime high-water mark, the peak belongs only to the
+        region inside the context manager.
+
+        Args:
+            interval_s: Seconds between samples
+        """
+        self.interval_s = interval_s
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.end_mb = current_rss_mb()
+        self.peak_mb = max(self.peak_mb, self.end_mb)
+        return False
+
+class Span:
+    def __init__(self, tracer, name, attrs):
+        """
+        A single timed region of the pipeline
+
+        Args:
+            tracer: Tracer that owns the span
+            name: Stage name, e.g. "enhance" or "llava.generate"
+            attrs: Initial attributes to attach to the span
+        """
+        self.tracer = tracer
+        self.name = name
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs):
+        """Attach attributes such as token counts to the span"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start_rss_mb = self.peak_rss_mb = current_rss_mb()
+        self.peak_tensor_mb = self.tracer._restart_tensor_peak(self)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_s = time.perf_counter() - self.start_wall
+        self.cpu_s = time.process_time() - self.start_cpu
+        self.tracer._close_rss(self)
+        self.rss_mb = current_rss_mb()
+        self.peak_rss_mb = max(self.peak_rss_mb, self.rss_mb)
+        self.peak_rss_delta_mb = self.peak_rss_mb - self.start_rss_mb
+        self.tensor_mb, peak_tensor_mb = tensor_memory_mb()
+        if peak_tensor_mb is not None:
+            self.peak_tensor_mb = max(self.peak_tensor_mb or 0.0, peak_tensor_mb)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer._finish(self)
+        return False
+
+class _NullSpan:
+    """Span stand-in used when tracing is disabled"""
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class NullTracer:
+    """Tracer with the same interface as Tracer that records nothing"""
+    enabled = False
+
+    def span(self, name, **attrs):
+        return _NULL_SPAN
+
+NULL_TRACER = NullTracer()
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, rss_interval_s=0.01):
+        """
+        Collects per-stage timings and resource usage for pipeline runs
+
+        Spans can be exported as Chrome trace JSON (loadable in chrome://tracing
+        and Perfetto) or aggregated into a per-run summary table. While spans
+        are open, one background thread samples RSS to track each span's peak,
+        including memory freed again before the span ends.
+
+        Args:
+            rss_interval_s: Seconds between RSS samples
+        """
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.rss_interval_s = rss_interval_s
+        self._lock = threading.Lock()
+        self._open_spans = []
+        self._rss_spans = []
+        self._rss_wakeup = threading.Condition(self._lock)
+        self._rss_thread = None
+
+    def span(self, name, **attrs):
+        """
+        Create a span to be used as a context manager
+
+        Args:
+            name: Stage name
+            **attrs: Attributes to attach, e.g. image path
+
+        Returns:
+            Span instance
+        """
+        return Span(self, name, attrs)
+
+    def _sample_rss(self):
+        """Background loop raising the RSS peak of every open span"""
+        with self._lock:
+            while True:
+                while not self._rss_spans:
+                    self._rss_wakeup.wait()
+                self._rss_wakeup.wait(self.rss_interval_s)
+                rss_mb = current_rss_mb()
+                for span in self._rss_spans:
+                    span.peak_rss_mb = max(span.peak_rss_mb, rss_mb)
+
+    def _open_rss(self, span):
+        """Start tracking the RSS peak of a span, starting the sampler thread on first use"""
+        self._rss_spans.append(span)
+        if self._rss_thread is None:
+            self._rss_thread = threading.Thread(target=self._sample_rss, daemon=True)
+            self._rss_thread.start()
+        self._rss_wakeup.notify()
+
+    def _close_rss(self, span):
+        """Stop tracking the RSS peak of a span"""
+        with self._lock:
+            if span in self._rss_spans:
+                self._rss_spans.remove(span)
+
+    def _restart_tensor_peak(self, span):
+        """
+        Reset the accelerator peak counter for a new span
+
+        The peak reached so far is first folded into the enclosing open
+        spans, so resetting for a nested span does not lose their peaks.
+
+        Returns:
+            Initial peak tensor memory for the span (None without a GPU)
+        """
+        with self._lock:
+            self._open_rss(span)
+            _, peak = tensor_memory_mb()
+            if peak is None:
+                self._open_spans.append(span)
+                return None
+            for open_span in self._open_spans:
+                open_span.peak_tensor_mb = max(open_span.peak_tensor_mb or 0.0, peak)
+            reset_tensor_peak()
+            self._open_spans.append(span)
+            return tensor_memory_mb()[0]
+
+    def _finish(self, span):
+        """Store a completed span"""
+        span.thread_id = threading.get_ident()
+        with self._lock:
+            if span in self._open_spans:
+                self._open_spans.remove(span)
+            self.spans.append(span)
+
+    def to_chrome_trace(self):
+        """
+        Convert recorded spans to the Chrome trace event format
+
+        Returns:
+            Dictionary with a traceEvents list of complete ("X") events
+        """
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = dict(span.attrs)
+            args["cpu_ms"] = round(span.cpu_s * 1000, 3)
+            args["rss_mb"] = round(span.rss_mb, 1)
+            args["peak_rss_mb"] = round(span.peak_rss_mb, 1)
+            args["peak_rss_delta_mb"] = round(span.peak_rss_delta_mb, 1)
+            if span.peak_tensor_mb is not None:
+                args["tensor_mb"] = round(span.tensor_mb, 1)
+                args["peak_tensor_mb"] = round(span.peak_tensor_mb, 1)
+
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start_wall - self.origin) * 1e6,
+                "dur": span.wall_s * 1e6,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": args
+            })
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, output_path):
+        """Write spans as Chrome trace / Perfetto compatible JSON"""
+        with open(output_path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def summary(self):
+        """
+        Aggregate spans by name
+
+        Returns:
+            Dictionary mapping span name to aggregated metrics
+        """
+        stages = {}
+        for span in self.spans:
+            stage = stages.setdefault(span.name, {
+                "count": 0,
+                "wall_s": 0.0,
+                "cpu_s": 0.0,
+                "max_wall_s": 0.0,
+                "peak_rss_mb": 0.0,
+                "peak_rss_delta_mb": None,
+                "peak_tensor_mb": None,
+                "prompt_tokens": 0,
+                "generated_tokens": 0
+            })
+            stage["count"] += 1
+            stage["wall_s"] += span.wall_s
+            stage["cpu_s"] += span.cpu_s
+            stage["max_wall_s"] = max(stage["max_wall_s"], span.wall_s)
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"], span.peak_rss_mb)
+            stage["peak_rss_delta_mb"] = (span.peak_rss_delta_mb if stage["peak_rss_delta_mb"] is None
+                                          else max(stage["peak_rss_delta_mb"], span.peak_rss_delta_mb))
+            if span.peak_tensor_mb is not None:
+                stage["peak_tensor_mb"] = max(stage["peak_tensor_mb"] or 0.0, span.peak_tensor_mb)
+            stage["prompt_tokens"] += span.attrs.get("prompt_tokens", 0)
+            stage["generated_tokens"] += span.attrs.get("generated_tokens", 0)
+
+        for stage in stages.values():
+            stage["mean_wall_s"] = stage["wall_s"] / stage["count"]
+            stage["tokens_per_s"] = (stage["generated_tokens"] / stage["wall_s"]
+                                     if stage["generated_tokens"] and stage["wall_s"] > 0 else None)
+
+        return stages
+
+    def format_summary(self):
+        """
+        Render the per-run summary as a plain-text table
+
+        Returns:
+            Table string
+        """
+        header = (f"{'stage':<28}{'count':>7}{'wall s':>10}{'mean s':>10}{'cpu s':>10}{'tok/s':>9}"
+                  f"{'peak MB':>9}{'+peak MB':>10}")
+        lines = [header, "-" * len(header)]
+        for name, stage in self.summary().items():
+            tokens_per_s = f"{stage['tokens_per_s']:.1f}" if stage["tokens_per_s"] else "-"
+            lines.append(
+                f"{name:<28}{stage['count']:>7}{stage['wall_s']:>10.3f}{stage['mean_wall_s']:>10.3f}"
+                f"{stage['cpu_s']:>10.3f}{tokens_per_s:>9}{stage['peak_rss_mb']:>9.0f}"
+                f"{stage['peak_rss_delta_mb']:>10.0f}"
+            )
+        return "\n".join(lines)
@@ -1,19 +1,200 @@
 # Create main.py
 import os
+import sys
+import copy
+import shutil
 import argparse
 import json
+import subprocess
+import time
 import cv2
+import torch
 from tqdm import tqdm
 
 # Import project modules
 from src.preprocessing.image_enhancement import enhance_prescription
+from src.preprocessing.deduplication import DuplicateIndex, names_match
+from src.preprocessing.image_budget import ImageTokenBudget
 from src.model.llava_interface import LlavaExtractor
+from src.model.cascade import ModelCascade
+from src.model.field_reextraction import FieldReextractor
 from src.model.prompt_templates import get_extraction_prompt, get_verification_prompt
 from src.postprocessing.json_formatter import JsonFormatter
 from src.postprocessing.medical_validator import MedicalValidator
+from src.postprocessing.verification_policy import VerificationPolicy
 from src.evaluation.metrics import PrescriptionEvaluator
+from src.instrumentation.tracing import Tracer, NULL_TRACER
+from src.runtime.checkpoint import RunManifest, UNFETCHED, atomic_write_json, file_sha256
+from src.runtime.http_fetch import ImageFetcher
+from src.runtime.sharding import (parse_shard_spec, select_shard, plan_replicas, replica_command,
+                                  shard_dir_name, merge_shard_outputs)
 
-def process_prescription(image_path, llava_model, formatter, validator, output_dir=None):
+def get_results_path(image_path, output_dir):
+    """Path of the per-image results file for an input"""
+    base_name = os.path.basename(image_path).split('.')[0]
+    return os.path.join(output_dir, f"{base_name}_results.json")
+
+def extract_and_validate(image_path, llava_model, formatter, validator, tracer, verification_policy=None,
+                         field_reextractor=None):
+    """
+    Run the model passes, post-processing and validation for one image
+    
+    Args:
+        image_path: Path to prescription image
+        llava_model: Initialized LlavaExtractor instance
+        formatter: Initialized JsonFormatter instance
+        validator: Initialized MedicalValidator instance
+        tracer: Tracer for per-stage instrumentation
+        verification_policy: VerificationPolicy gating the second pass (optional, always verifies if None)
+        field_reextractor: FieldReextractor to re-read only the suspect fields instead of
+            running the full verification pass where possible (optional)
+        
+    Returns:
+        Validated prescription data with a 'processing' record of the path taken
+    """
+    # Step 2: Extract text with LLaVA
+    prompt = get_extraction_prompt()
+    with tracer.span("extract"):
+        raw_response = llava_model.extract_prescription_data(image_path, prompt)
+    
+    # Step 3: Format response to JSON
+    with tracer.span("format"):
+        extracted_data = formatter.format_response(raw_response)
+    
+    # Step 4: Verify extracted data with a second pass when the policy asks for it
+    if verification_policy is not None:
+        with tracer.span("verification_policy"):
+            assessment = verification_policy.assess(extracted_data)
+    else:
+        assessment = {'verify': True, 'confidence': None, 'suspect_fields': [], 'reasons': ["Always verify"]}
+    
+    final_data = extracted_data
+    verification = "run" if assessment['verify'] else "skipped"
+    field_record = {}
+    full_verification = assessment['verify']
+    if (assessment['verify'] and field_reextractor is not None and "error" not in extracted_data
+            and field_reextractor.can_reextract(assessment['suspect_fields'])):
+        # Short per-field prompts instead of regenerating the whole record
+        with tracer.span("reextract_fields", fields=len(assessment['suspect_fields'])):
+            reextracted, replaced, unresolved = field_reextractor.reextract(
+                llava_model, image_path, extracted_data, assessment['suspect_fields'])
+        field_record = {'reextracted_fields': replaced, 'unresolved_fields': unresolved}
+        if replaced:
+            final_data = reextracted
+            verification = "fields"
+            full_verification = False
+        else:
+            # None of the suspect fields could be read on their own; fall back to the full pass
+            field_record['field_fallback'] = True
+    
+    if full_verification:
+        verification_prompt = get_verification_prompt(json.dumps(extracted_data, indent=2))
+        with tracer.span("verify"):
+            verification_response = llava_model.extract_prescription_data(image_path, verification_prompt)
+        with tracer.span("format"):
+            verified_data = formatter.format_response(verification_response)
+        
+        # If verification worked, use the verified data
+        if "error" not in verified_data:
+            final_data = verified_data
+    
+    # Step 5: Standardize medical terms
+    with tracer.span("standardize"):
+        standardized_data = formatter.standardize_medical_terms(final_data)
+    
+    # Step 6: Validate data
+    with tracer.span("validate"):
+        validated_data = validator.validate_prescription(standardized_data)
+    
+    # Record which path the prescription took
+    validated_data['processing'] = {
+        'verification': verification,
+        'first_pass_confidence': assessment['confidence'],
+        'suspect_fields': assessment['suspect_fields'],
+        'verification_reasons': assessment['reasons'],
+        **field_record
+    }
+    
+    return validated_data
+
+def extract_with_cascade(image_path, cascade, formatter, validator, tracer, verification_policy=None,
+                         field_reextractor=None):
+    """
+    Extract with the small model first and escalate to the large model if needed
+    
+    Args:
+        image_path: Path to prescription image
+        cascade: Initialized ModelCascade instance
+        formatter: Initialized JsonFormatter instance
+        validator: Initialized MedicalValidator instance
+        tracer: Tracer for per-stage instrumentation
+        verification_policy: VerificationPolicy gating each tier's second pass (optional)
+        field_reextractor: FieldReextractor used by each tier in place of full verification (optional)
+        
+    Returns:
+        Validated prescription data with the cascade path under 'processing'
+    """
+    cascade.stats['prescriptions'] += 1
+    
+    start = time.perf_counter()
+    with tracer.span("cascade.small"):
+        small_result = extract_and_validate(image_path, cascade.small_model, formatter, validator, tracer,
+                                            verification_policy, field_reextractor)
+    cascade.stats['small_time_s'] += time.perf_counter() - start
+    
+    decision, suspect_fields = cascade.decide(small_result)
+    if decision == "accept":
+        cascade.stats['accepted_small'] += 1
+        small_result['processing']['cascade'] = {'tier': "small", 'escalation': None}
+        return small_result
+    
+    if decision == "fields":
+        # Ask the large model only for the suspect fields, not for a whole new record
+        start = time.perf_counter()
+        with tracer.span("cascade.large_fields", fields=len(suspect_fields)):
+            merged, replaced, unresolved = cascade.field_reextractor.reextract(
+                cascade.large_model, image_path, cascade.strip_metadata(small_result), suspect_fields)
+        cascade.stats['large_time_s'] += time.perf_counter() - start
+        
+        if replaced:
+            cascade.stats['escalated_fields'] += 1
+            # Large-model answers go through the same standardization as a full extraction
+            with tracer.span("standardize"):
+                merged = formatter.standardize_medical_terms(merged)
+            with tracer.span("validate"):
+                result = validator.validate_prescription(merged)
+            result['processing'] = small_result['processing']
+            result['processing']['cascade'] = {
+                'tier': "small+large",
+                'escalation': "fields",
+                'escalated_fields': replaced,
+                'unresolved_fields': unresolved
+            }
+            return result
+        # The large model could not read any of the fields either; fall back to a full re-extraction
+    
+    start = time.perf_counter()
+    with tracer.span("cascade.large"):
+        large_result = extract_and_validate(image_path, cascade.large_model, formatter, validator, tracer,
+                                            verification_policy, field_reextractor)
+    cascade.stats['large_time_s'] += time.perf_counter() - start
+    
+    if "error" in large_result and "error" not in small_result:
+        # The large model did not produce usable output; keep the small-model result
+        cascade.stats['escalated_full'] += 1
+        small_result['processing']['cascade'] = {'tier': "small", 'escalation': "failed"}
+        return small_result
+    
+    cascade.stats['escalated_full'] += 1
+    large_result['processing']['cascade'] = {
+        'tier': "large",
+        'escalation': "full",
+        'suspect_fields': suspect_fields
+    }
+    return large_result
+
+def process_prescription(image_path, llava_model, formatter, validator, output_dir=None, tracer=None,
+                         verification_policy=None, dedup_index=None, cascade=None, field_reextractor=None):
     """
     Process a single prescription image through the entire pipeline
     
@@ -23,106 +204,489 @@ def process_prescription(image_path, llava_model, formatter, validator, output_d
         formatter: Initialized JsonFormatter instance
         validator: Initialized MedicalValidator instance
         output_dir: Directory to save intermediate results (optional)
+        tracer: Tracer for per-stage instrumentation (optional)
+        verification_policy: VerificationPolicy gating the second pass (optional, always verifies if None)
+        dedup_index: DuplicateIndex to reuse results of near-duplicate scans (optional)
+        cascade: ModelCascade to try a small model before llava_model (optional)
+        field_reextractor: FieldReextractor to re-read suspect fields instead of full verification (optional)
         
     Returns:
         Extracted and validated prescription data
     """
+    tracer = tracer or NULL_TRACER
     print(f"Processing {image_path}...")
     
-    # Step 1: Enhance image
-    enhanced_img = enhance_prescription(image_path)
+    with tracer.span("process_prescription", image=image_path):
+        # Step 1: Enhance image
+        with tracer.span("enhance"):
+            enhanced_img = enhance_prescription(image_path)
+        
+        # Plan the model's image crops from the enhanced image, saving a second enhancement pass
+        image_budget = getattr(llava_model, 'image_budget', None)
+        if image_budget is not None:
+            image_budget.register(image_path, enhanced_img)
+        
+        # Save enhanced image if output directory provided
+        if output_dir:
+            base_name = os.path.basename(image_path).split('.')[0]
+            enhanced_path = os.path.join(output_dir, f"{base_name}_enhanced.jpg")
+            with tracer.span("save_enhanced"):
+                cv2.imwrite(enhanced_path, enhanced_img)
+        
+        # Look for an already processed scan of the same prescription
+        duplicate = None
+        rejected = None
+        if dedup_index is not None:
+            with tracer.span("dedup_lookup"):
+                signature = dedup_index.compute_signature(enhanced_img)
+                duplicate = dedup_index.find(signature)
+        
+        # Never hand one patient's prescription to another: re-read the name before reusing
+        if duplicate is not None:
+            with tracer.span("dedup_patient_check"):
+                guard_model = cascade.small_model if cascade is not None else llava_model
+                checked, _, _ = FieldReextractor(formatter, max_new_tokens=24).reextract(
+                    guard_model, image_path, {'patient_name': None}, ["patient_name"])
+            reused_name = duplicate['result'].get('patient_name')
+            if not names_match(checked['patient_name'], reused_name):
+                rejected = {
+                    'image_path': duplicate['image_path'],
+                    'similarity': duplicate['similarity'],
+                    'patient_name': checked['patient_name']
+                }
+                duplicate = None
+        
+        if duplicate is not None:
+            validated_data = copy.deepcopy(duplicate['result'])
+            validated_data['processing'] = {
+                'verification': "reused",
+                'duplicate_of': duplicate['image_path'],
+                'duplicate_similarity': duplicate['similarity'],
+                'patient_check': checked['patient_name']
+            }
+        else:
+            if cascade is not None:
+                validated_data = extract_with_cascade(image_path, cascade, formatter, validator, tracer,
+                                                      verification_policy, field_reextractor)
+            else:
+                validated_data = extract_and_validate(image_path, llava_model, formatter, validator, tracer,
+                                                      verification_policy, field_reextractor)
+            if dedup_index is not None:
+                validated_data['processing']['duplicate_of'] = None
+                if rejected is not None:
+                    validated_data['processing']['duplicate_rejected'] = rejected
+        
+        # Record image tokens and model time spent on this prescription
+        if image_budget is not None:
+            models = [cascade.small_model, cascade.large_model] if cascade is not None else [llava_model]
+            usage = None
+            for model in models:
+                model_usage = model.pop_usage(image_path)
+                if usage is None:
+                    usage = model_usage
+                elif model_usage is not None:
+                    for key in ('calls', 'image_tokens', 'prompt_tokens', 'generated_tokens', 'model_s'):
+                        usage[key] += model_usage[key]
+            if usage is not None:
+                validated_data['processing']['image_budget'] = usage
+            image_budget.forget(image_path)
+        
+        # Save results if output directory provided
+        results_path = get_results_path(image_path, output_dir) if output_dir else None
+        if output_dir:
+            with tracer.span("save_results"):
+                atomic_write_json(results_path, validated_data)
+        
+        # Only clean, validated originals are offered for reuse
+        if dedup_index is not None and duplicate is None and validated_data['validation']['is_valid']:
+            dedup_index.add(signature, image_path, validated_data, results_path)
     
-    # Save enhanced image if output directory provided
-    if output_dir:
-        base_name = os.path.basename(image_path).split('.')[0]
-        enhanced_path = os.path.join(output_dir, f"{base_name}_enhanced.jpg")
-        cv2.imwrite(enhanced_path, enhanced_img)
+    return validated_data
+
+def evaluate_results(results, gt_file, output_dir, indices=None):
+    """
+    Evaluate results against ground truth and save the metrics
     
-    # Step 2: Extract text with LLaVA
-    prompt = get_extraction_prompt()
-    raw_response = llava_model.extract_prescription_data(image_path, prompt)
+    Args:
+        results: List of prescription results in run order
+        gt_file: Path to ground truth JSON file aligned with the full input list
+        output_dir: Directory to save evaluation_metrics.json
+        indices: Positions of the results in the full input list (optional, for shards)
+        
+    Returns:
+        Dictionary of evaluation metrics, or None if there are no results
+    """
+    if not results:
+        print("Warning: No results to evaluate")
+        return None
     
-    # Step 3: Format response to JSON
-    extracted_data = formatter.format_response(raw_response)
+    evaluator = PrescriptionEvaluator()
     
-    # Step 4: Verify extracted data with a second pass
-    verification_prompt = get_verification_prompt(json.dumps(extracted_data, indent=2))
-    verification_response = llava_model.extract_prescription_data(image_path, verification_prompt)
-    verified_data = formatter.format_response(verification_response)
+    # Load ground truth
+    with open(gt_file, 'r') as f:
+        ground_truth = json.load(f)
+    if indices is not None:
+        ground_truth = [ground_truth[i] for i in indices]
     
-    # If verification worked, use the verified data
-    if "error" not in verified_data:
-        final_data = verified_data
-    else:
-        final_data = extracted_data
+    # Evaluate
+    metrics = evaluator.evaluate_dataset(results, ground_truth)
     
-    # Step 5: Standardize medical terms
-    standardized_data = formatter.standardize_medical_terms(final_data)
+    # Save metrics
+    metrics_path = os.path.join(output_dir, "evaluation_metrics.json")
+    with open(metrics_path, 'w') as f:
+        json.dump(metrics, f, indent=2)
     
-    # Step 6: Validate data
-    validated_data = validator.validate_prescription(standardized_data)
+    print(f"Overall evaluation score: {metrics['overall_score']:.2f}")
     
-    # Save results if output directory provided
-    if output_dir:
-        results_path = os.path.join(output_dir, f"{base_name}_results.json")
-        with open(results_path, 'w') as f:
-            json.dump(validated_data, f, indent=2)
+    return metrics
+
+def strip_cli_options(argv, options):
+    """Remove options and their values from an argument list"""
+    stripped = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+            continue
+        name = arg.split('=', 1)[0]
+        if name in options:
+            skip_next = '=' not in arg
+            continue
+        stripped.append(arg)
+    return stripped
+
+def run_replicas(args):
+    """
+    Run the pipeline as several pinned worker processes and merge their outputs
     
-    return validated_data
+    Each replica handles a slice of this node's shard (passed as --replica),
+    runs on its own CPU set (one NUMA node where possible) and writes to its
+    own directory.
+    
+    Args:
+        args: Parsed command line arguments
+    """
+    shard_index, num_shards = parse_shard_spec(args.shard)
+    plans = plan_replicas(args.replicas)
+    
+    base_argv = strip_cli_options(sys.argv[1:], {"--replicas", "--replica", "--output_dir", "--num_threads"})
+    
+    workers = []
+    shard_dirs = []
+    for r, plan in enumerate(plans):
+        shard_dir = os.path.join(args.output_dir, shard_dir_name(shard_index, num_shards, r, args.replicas))
+        shard_dirs.append(shard_dir)
+        
+        num_threads = args.num_threads or len(plan["cpus"])
+        command = [sys.executable, "-m", "src.main"] + base_argv + [
+            "--replica", f"{r}/{args.replicas}",
+            "--output_dir", shard_dir,
+            "--num_threads", str(num_threads)
+        ]
+        command, pinned = replica_command(command, plan)
+        
+        env = dict(os.environ, OMP_NUM_THREADS=str(num_threads), MKL_NUM_THREADS=str(num_threads))
+        cpus = plan["cpus"]
+        preexec = None if pinned else (lambda cpus=cpus: os.sched_setaffinity(0, cpus))
+        
+        print(f"Starting replica {r} on CPUs {cpus[0]}-{cpus[-1]} (NUMA node {plan['numa_node']})")
+        workers.append(subprocess.Popen(command, env=env, preexec_fn=preexec))
+    
+    for r, worker in enumerate(workers):
+        if worker.wait() != 0:
+            print(f"Warning: Replica {r} exited with code {worker.returncode}")
+    
+    merge_outputs(shard_dirs, args.output_dir, args.gt_file)
+
+def merge_outputs(shard_dirs, output_dir, gt_file=None):
+    """
+    Merge shard outputs into one all_results.json and evaluate them
+    
+    Results are evaluated against the ground truth at their recorded input
+    positions, so a merge of only some of the shards evaluates what it has.
+    
+    Args:
+        shard_dirs: Output directories of the shards
+        output_dir: Directory for the merged outputs
+        gt_file: Path to ground truth JSON file (optional)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    image_files, results, positions = merge_shard_outputs(shard_dirs, output_dir)
+    print(f"Merged {len(results)} results from {len(shard_dirs)} shards into {output_dir}")
+    
+    if gt_file:
+        if None in positions:
+            print("Warning: Some shard manifests do not record input positions; skipping evaluation")
+            return
+        with open(gt_file, 'r') as f:
+            num_samples = len(json.load(f))
+        if len(positions) < num_samples:
+            print(f"Warning: Merged shards cover {len(positions)} of {num_samples} ground truth samples; "
+                  f"evaluating those only")
+        evaluate_results(results, gt_file, output_dir, positions)
 
 def main():
     """Main execution function"""
     parser = argparse.ArgumentParser(description="Medical Prescription Extraction Pipeline")
-    parser.add_argument("--input_dir", type=str, required=True, help="Directory containing prescription images")
+    parser.add_argument("--input_dir", type=str, help="Directory containing prescription images")
+    parser.add_argument("--url_list", type=str,
+                        help="Text file with one prescription image URL per line, processed in file order")
+    parser.add_argument("--fetch_cache_dir", type=str,
+                        help="Cache for downloaded images (defaults to <output_dir>/fetch_cache)")
+    parser.add_argument("--fetch_workers", type=int, default=8,
+                        help="Number of concurrent downloads for --url_list inputs")
+    parser.add_argument("--prefetch", type=int,
+                        help="Maximum downloads kept ahead of processing (defaults to 2 * --fetch_workers)")
     parser.add_argument("--output_dir", type=str, default="output", help="Directory to save results")
     parser.add_argument("--gt_file", type=str, help="Path to ground truth JSON file (optional)")
     parser.add_argument("--model_name", type=str, default="llava-hf/llava-1.5-13b-hf", help="LLaVA model name")
     parser.add_argument("--medical_terms", type=str, help="Path to medical terminology JSON file (optional)")
+    parser.add_argument("--verification", type=str, choices=["always", "gated", "fields"], default="always",
+                        help="Run the verification pass always, only when the first pass looks unreliable, "
+                             "or (fields) re-read just the suspect fields when the first pass looks unreliable")
+    parser.add_argument("--verify_threshold", type=float, default=0.9,
+                        help="Validator confidence below which the gated verification pass runs")
+    parser.add_argument("--no_prefix_cache", action="store_true",
+                        help="Disable key/value caching of the constant prompt prefixes")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip inputs already completed in the output directory's run manifest")
+    parser.add_argument("--max_attempts", type=int, default=3,
+                        help="Maximum attempts per input before it is left as failed")
+    parser.add_argument("--shard", type=str, default="0/1",
+                        help="Process only shard i of N (i/N), split deterministically by file name hash")
+    parser.add_argument("--replicas", type=int, default=1,
+                        help="Number of local model workers, each pinned to its own NUMA node or core set")
+    parser.add_argument("--replica", type=str, default="0/1",
+                        help="Process only slice r of K (r/K) of this shard; set by --replicas for its workers")
+    parser.add_argument("--num_threads", type=int, help="Number of torch threads per worker (optional)")
+    parser.add_argument("--merge_shards", type=str, nargs="+",
+                        help="Merge these shard output directories into --output_dir instead of running")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Reuse results of re-scans of an already processed prescription, after "
+                             "comparing their text and re-reading the patient name")
+    parser.add_argument("--dedup_similarity", type=float, default=0.94,
+                        help="Minimum aligned text match score for a duplicate: 1 minus the largest fraction "
+                             "of mismatched ink in any glyph-sized window (calibrated by run_benchmark)")
+    parser.add_argument("--max_memory", type=str,
+                        help="Memory budget for the model (e.g. 24GiB); layers beyond it are offloaded to disk")
+    parser.add_argument("--offload_folder", type=str, help="Directory for layers offloaded under --max_memory")
+    parser.add_argument("--low_memory_load", action="store_true",
+                        help="Stream weights into place without a transient full copy of the model")
+    parser.add_argument("--cascade_small_model", type=str,
+                        help="Smaller LLaVA-1.5-format model to try first, escalating to --model_name (optional)")
+    parser.add_argument("--cascade_threshold", type=float, default=0.9,
+                        help="Validator confidence needed to accept a small-model result without escalation")
+    parser.add_argument("--draft_model", type=str,
+                        help="Smaller LLaVA model with the same tokenizer for speculative decoding (optional)")
+    parser.add_argument("--num_draft_tokens", type=int,
+                        help="Initial number of tokens the draft model proposes per step")
+    parser.add_argument("--prompt_lookup_tokens", type=int,
+                        help="Speculate by copying up to this many tokens from matching prompt spans "
+                             "(used when no --draft_model is given)")
+    parser.add_argument("--image_budget", action="store_true",
+                        help="Crop sparse prescriptions to one image and tile dense ones at full resolution")
+    parser.add_argument("--sparse_max_lines", type=int, default=10,
+                        help="Prescriptions with at most this many text lines get a single image")
+    parser.add_argument("--max_tiles", type=int, default=4, help="Maximum number of tiles for dense prescriptions")
+    parser.add_argument("--trace", action="store_true", help="Record per-stage timings and resource usage")
     args = parser.parse_args()
     
+    if args.merge_shards:
+        merge_outputs(args.merge_shards, args.output_dir, args.gt_file)
+        return
+    if not args.input_dir and not args.url_list:
+        parser.error("--input_dir or --url_list is required unless --merge_shards is given")
+    
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
     
+    if args.replicas > 1:
+        run_replicas(args)
+        return
+    
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    
+    tracer = Tracer() if args.trace else NULL_TRACER
+    
+    fetcher = None
+    if args.url_list:
+        fetcher = ImageFetcher(args.fetch_cache_dir or os.path.join(args.output_dir, "fetch_cache"),
+                               max_workers=args.fetch_workers)
+    
+    image_budget = None
+    if args.image_budget:
+        image_budget = ImageTokenBudget(sparse_max_lines=args.sparse_max_lines, max_tiles=args.max_tiles)
+    
     # Initialize components
-    llava_model = LlavaExtractor(model_name=args.model_name)
+    loading_options = {
+        'tracer': tracer,
+        'fetcher': fetcher,
+        'image_budget': image_budget,
+        'prefix_cache': not args.no_prefix_cache,
+        'max_memory': args.max_memory,
+        'offload_folder': args.offload_folder,
+        'low_memory': args.low_memory_load
+    }
+    llava_model = LlavaExtractor(model_name=args.model_name, draft_model_name=args.draft_model,
+                                 num_draft_tokens=args.num_draft_tokens,
+                                 prompt_lookup_tokens=args.prompt_lookup_tokens, **loading_options)
+    models = [llava_model]
+    small_model = None
+    if args.cascade_small_model:
+        small_model = LlavaExtractor(model_name=args.cascade_small_model, **loading_options)
+        models.append(small_model)
+    for model in models:
+        load_stats = model.load_stats
+        print(f"Model loaded in {load_stats['load_s']:.1f}s, peak RSS {load_stats['peak_rss_mb']:.0f} MB while loading "
+              f"(+{load_stats['rss_after_load_mb'] - load_stats['rss_before_load_mb']:.0f} MB retained)"
+              + (f", {len(load_stats['offloaded_modules'])} modules offloaded to disk"
+                 if load_stats['offloaded_modules'] else ""))
     formatter = JsonFormatter(medical_terms_path=args.medical_terms)
     validator = MedicalValidator()
+    verification_policy = None
+    if args.verification in ("gated", "fields"):
+        verification_policy = VerificationPolicy(validator, confidence_threshold=args.verify_threshold)
+    field_reextractor = None
+    if args.verification == "fields":
+        field_reextractor = FieldReextractor(formatter)
+    cascade = None
+    if small_model is not None:
+        cascade = ModelCascade(small_model, llava_model, VerificationPolicy(validator), FieldReextractor(formatter),
+                               confidence_threshold=args.cascade_threshold)
     
-    # Get all image files
-    image_files = [
-        os.path.join(args.input_dir, f) 
-        for f in os.listdir(args.input_dir) 
-        if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-    ]
+    dedup_index = None
+    if args.dedup:
+        index_path = os.path.join(args.output_dir, "dedup_index.jsonl")
+        if not args.resume:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            shutil.rmtree(os.path.join(args.output_dir, "dedup_signatures"), ignore_errors=True)
+        dedup_index = DuplicateIndex(min_similarity=args.dedup_similarity, index_path=index_path)
     
-    # Process all images
-    results = []
-    for image_path in tqdm(image_files, desc="Processing prescriptions"):
-        result = process_prescription(image_path, llava_model, formatter, validator, args.output_dir)
-        results.append(result)
+    # Get all inputs: URLs in list order, or image files sorted so runs, resumes and shards see the same order
+    if args.url_list:
+        with open(args.url_list, 'r') as f:
+            image_files = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    else:
+        image_files = sorted(
+            os.path.join(args.input_dir, f) 
+            for f in os.listdir(args.input_dir) 
+            if f.lower().endswith(('.png', '.jpg', '.jpeg'))
+        )
     
-    # Save all results
-    all_results_path = os.path.join(args.output_dir, "all_results.json")
-    with open(all_results_path, 'w') as f:
-        json.dump(results, f, indent=2)
+    # Keep only this shard's inputs, remembering their positions for evaluation
+    shard_index, num_shards = parse_shard_spec(args.shard)
+    replica_index, num_replicas = parse_shard_spec(args.replica)
+    shard_indices = select_shard(image_files, shard_index, num_shards, replica_index, num_replicas)
+    image_files = [image_files[i] for i in shard_indices]
     
-    # Evaluate if ground truth provided
-    if args.gt_file:
-        evaluator = PrescriptionEvaluator()
-        
-        # Load ground truth
-        with open(args.gt_file, 'r') as f:
-            ground_truth = json.load(f)
+    # Track progress so an interrupted run can be resumed
+    manifest = RunManifest(args.output_dir, resume=args.resume, max_attempts=args.max_attempts,
+                           input_dir=args.input_dir)
+    # Written up front so a shard or replica with no inputs still merges cleanly
+    manifest.save()
+    
+    # URL inputs are downloaded concurrently ahead of the model; local files are used in place
+    positions = list(range(len(image_files)))
+    if fetcher is not None:
+        # URLs that already failed to download max_attempts times are not requested again
+        positions = [i for i in positions if manifest.needs_processing(image_files[i], UNFETCHED)]
+        if len(positions) < len(image_files):
+            print(f"Skipping {len(image_files) - len(positions)} URLs that failed to download "
+                  f"{args.max_attempts} times")
+        inputs = fetcher.iter_prefetched([image_files[i] for i in positions], depth=args.prefetch)
+    else:
+        inputs = ((image_path, image_path, None) for image_path in image_files)
+    
+    # Process all images, keyed in the manifest by their URL or path within the input directory
+    processed = 0
+    budget_usage = []
+    start = time.perf_counter()
+    for position, (source, local_path, fetch_error) in zip(
+            positions, tqdm(inputs, total=len(positions), desc="Processing prescriptions")):
+        if fetch_error is not None:
+            print(f"Warning: Failed to fetch {source}: {fetch_error}")
+            manifest.mark_failed(source, UNFETCHED, fetch_error, position=shard_indices[position])
+            continue
         
-        # Evaluate
-        metrics = evaluator.evaluate_dataset(results, ground_truth)
+        content_hash = file_sha256(local_path)
+        if not manifest.needs_processing(source, content_hash):
+            continue
         
-        # Save metrics
-        metrics_path = os.path.join(args.output_dir, "evaluation_metrics.json")
-        with open(metrics_path, 'w') as f:
-            json.dump(metrics, f, indent=2)
+        try:
+            result = process_prescription(local_path, llava_model, formatter, validator, args.output_dir, tracer,
+                                          verification_policy, dedup_index, cascade, field_reextractor)
+        except Exception as e:
+            print(f"Warning: Failed to process {source}: {e}")
+            manifest.mark_failed(source, content_hash, e, position=shard_indices[position])
+            continue
         
-        print(f"Overall evaluation score: {metrics['overall_score']:.2f}")
+        manifest.mark_completed(source, content_hash, get_results_path(local_path, args.output_dir),
+                                position=shard_indices[position])
+        processed += 1
+        if 'image_budget' in result['processing']:
+            budget_usage.append(result['processing']['image_budget'])
+    elapsed = time.perf_counter() - start
+    
+    # Save all results, rebuilt from the stored per-image results
+    results = manifest.load_results(image_files)
+    all_results_path = os.path.join(args.output_dir, "all_results.json")
+    atomic_write_json(all_results_path, results)
+    
+    if processed:
+        print(f"Processed {processed} prescriptions in {elapsed:.1f}s ({processed / elapsed:.3f} prescriptions/s)")
+    
+    if fetcher is not None:
+        stats = fetcher.stats
+        print(f"Fetched {stats['downloaded']} images ({stats['bytes'] / 1e6:.1f} MB), "
+              f"{stats['revalidated']} served from cache after revalidation")
+        fetcher.close()
+    
+    for model in models:
+        if model.prefix_cache and not model.speculative:
+            stats = model.prefix_cache_stats
+            print(f"Prefix cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['cached_tokens']} prompt tokens reused, "
+                  f"{stats['prefill_time_saved_s']:.2f}s prefill saved")
+    
+    if llava_model.speculative:
+        summary = llava_model.speculation_summary()
+        acceptance = (f", {summary['acceptance_rate']:.1%} of drafted tokens accepted"
+                      if summary['acceptance_rate'] is not None else "")
+        print(f"Speculative decoding: {summary['generated_tokens']} tokens in {summary['target_forwards']} "
+              f"model passes ({summary['tokens_per_target_forward']:.2f} tokens/pass){acceptance}")
+    
+    if budget_usage:
+        for label, group in (("single image", [u for u in budget_usage if u['tiles'] == 1]),
+                             ("tiled", [u for u in budget_usage if u['tiles'] > 1])):
+            if group:
+                print(f"Image budget, {label}: {len(group)} prescriptions, "
+                      f"{sum(u['image_tokens'] for u in group) / len(group):.0f} image tokens and "
+                      f"{sum(u['model_s'] for u in group) / len(group):.1f}s model time per prescription")
+    
+    if field_reextractor is not None:
+        stats = field_reextractor.stats
+        print(f"Field re-extraction: {stats['prescriptions']} prescriptions, {stats['field_prompts']} field prompts, "
+              f"{stats['fields_replaced']} fields replaced, {stats['fields_unresolved']} unreadable")
+    
+    if cascade is not None:
+        stats = cascade.stats
+        print(f"Cascade: {stats['prescriptions']} prescriptions, {cascade.escalation_rate():.1%} escalated "
+              f"({stats['escalated_fields']} field-level, {stats['escalated_full']} full), "
+              f"small model {stats['small_time_s']:.1f}s, large model {stats['large_time_s']:.1f}s")
+    
+    # Save traces if enabled
+    if tracer.enabled:
+        tracer.export_chrome_trace(os.path.join(args.output_dir, "trace.json"))
+        with open(os.path.join(args.output_dir, "trace_summary.json"), 'w') as f:
+            json.dump(tracer.summary(), f, indent=2)
+        print(tracer.format_summary())
+    
+    # Evaluate if ground truth provided
+    if args.gt_file:
+        evaluate_results(results, args.gt_file, args.output_dir,
+                         shard_indices if num_shards * num_replicas > 1 else None)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,124 @@
+# model/cascade.py
+
+import re
+import copy
+
+FIELD_PATH_PATTERN = re.compile(r"^(\w[\w/]*)(?:\[(\d+)\](?:\.(\w+))?)?$")
+
+def get_field(data, path):
+    """
+    Read a field by path, e.g. "patient_name" or "medication_list[0].dosage"
+
+    Returns:
+        Field value, or None if the path does not exist
+    """
+    match = FIELD_PATH_PATTERN.match(path)
+    if not match:
+        return None
+    field, index, subfield = match.groups()
+    value = data.get(field)
+    if index is None:
+        return value
+    if not isinstance(value, list) or int(index) >= len(value):
+        return None
+    item = value[int(index)]
+    if subfield is None:
+        return item
+    return item.get(subfield) if isinstance(item, dict) else None
+
+def set_field(data, path, value):
+    """
+    Write a field by path, creating medication entries as needed
+
+    Returns:
+        True if the field was written
+    """
+    match = FIELD_PATH_PATTERN.match(path)
+    if not match:
+        return False
+    field, index, subfield = match.groups()
+    if index is None:
+        data[field] = value
+        return True
+
+    items = data.get(field)
+    if not isinstance(items, list):
+        items = data[field] = []
+    index = int(index)
+    while len(items) <= index:
+        items.append({})
+    if subfield is None:
+        items[index] = value
+    elif isinstance(items[index], dict):
+        items[index][subfield] = value
+    else:
+        return False
+    return True
+
+class ModelCascade:
+    def __init__(self, small_model, large_model, verification_policy, field_reextractor=None,
+                 confidence_threshold=0.9, full_escalation_threshold=0.5):
+        """
+        Small-model-first extraction with escalation to the large model
+
+        Args:
+            small_model: LlavaExtractor for the fast first tier
+            large_model: LlavaExtractor for escalations
+            verification_policy: VerificationPolicy used to score small-model results
+            field_reextractor: FieldReextractor that asks the large model for just the suspect
+                fields (optional; without it every escalation re-extracts the whole record)
+            confidence_threshold: Validator confidence needed to accept a small-model result
+            full_escalation_threshold: Below this confidence the whole record is re-extracted
+                by the large model instead of only the suspect fields
+        """
+        self.small_model = small_model
+        self.large_model = large_model
+        self.verification_policy = verification_policy
+        self.field_reextractor = field_reextractor
+        self.confidence_threshold = confidence_threshold
+        self.full_escalation_threshold = full_escalation_threshold
+        self.stats = {
+            'prescriptions': 0,
+            'accepted_small': 0,
+            'escalated_fields': 0,
+            'escalated_full': 0,
+            'small_time_s': 0.0,
+            'large_time_s': 0.0
+        }
+
+    def strip_metadata(self, result):
+        """Copy a result without the validation and processing records"""
+        data = copy.deepcopy(result)
+        data.pop('validation', None)
+        data.pop('processing', None)
+        return data
+
+    def decide(self, small_result):
+        """
+        Decide how far a small-model result has to be escalated
+
+        Args:
+            small_result: Validated small-model result
+
+        Returns:
+            Tuple of ("accept" | "fields" | "full", list of suspect field paths)
+        """
+        if "error" in small_result:
+            return "full", []
+
+        confidence = small_result['validation']['overall_confidence']
+        suspect_fields = self.verification_policy.find_suspect_fields(self.strip_metadata(small_result))
+
+        if confidence >= self.confidence_threshold and not suspect_fields:
+            return "accept", []
+        if (confidence < self.full_escalation_threshold or self.field_reextractor is None
+                or not self.field_reextractor.can_reextract(suspect_fields)):
+            return "full", suspect_fields
+        return "fields", suspect_fields
+
+    def escalation_rate(self):
+        """Fraction of prescriptions that needed the large model"""
+        if not self.stats['prescriptions']:
+            return 0.0
+        escalated = self.stats['escalated_fields'] + self.stats['escalated_full']
+        return escalated / self.stats['prescriptions']
@@ -0,0 +1,107 @@
+# model/field_reextraction.py
+
+import re
+import copy
+
+from src.model.cascade import FIELD_PATH_PATTERN, get_field, set_field
+from src.model.prompt_templates import get_field_extraction_prompt
+
+NULL_ANSWERS = {"", "null", "none", "n/a", "unknown", "not legible", "illegible"}
+
+class FieldReextractor:
+    def __init__(self, formatter, max_new_tokens=48, max_fields=6):
+        """
+        Re-read individual suspect fields with short prompts instead of regenerating the record
+
+        Args:
+            formatter: Initialized JsonFormatter instance, used for whole-medication answers
+            max_new_tokens: Generation limit for a single field answer (four times this for a
+                whole medication entry)
+            max_fields: Above this many suspect fields a full verification pass is cheaper
+        """
+        self.formatter = formatter
+        self.max_new_tokens = max_new_tokens
+        self.max_fields = max_fields
+        self.stats = {
+            'prescriptions': 0,
+            'field_prompts': 0,
+            'fields_replaced': 0,
+            'fields_unresolved': 0
+        }
+
+    def can_reextract(self, fields):
+        """
+        Check whether every suspect field can be re-read on its own
+
+        A missing medication list has no field to anchor a short prompt to
+        and needs the full verification pass.
+        """
+        if not fields or len(fields) > self.max_fields:
+            return False
+        return all(FIELD_PATH_PATTERN.match(path) and path != "medication_list" for path in fields)
+
+    def _prompt_for(self, data, path):
+        """Build the field prompt for a field path"""
+        field, index, subfield = FIELD_PATH_PATTERN.match(path).groups()
+        if index is None:
+            return get_field_extraction_prompt(field)
+
+        medication_name = None
+        if subfield != "name":
+            medication_name = get_field(data, f"{field}[{index}].name")
+        return get_field_extraction_prompt(subfield or "medication", medication_number=int(index) + 1,
+                                           medication_name=medication_name)
+
+    def _parse_answer(self, path, text):
+        """
+        Turn a short model answer into a field value
+
+        Returns:
+            Field value, or None if the model could not read the field
+        """
+        if path.endswith("]"):
+            # Whole medication entry, answered as JSON
+            entry = self.formatter.format_response(text)
+            return None if "error" in entry else entry
+
+        value = re.sub(r"^```\w*|```$", "", text.strip()).strip()
+        value = value.splitlines()[0].strip() if value else ""
+        value = value.strip('"\'').rstrip('.').strip()
+        if value.lower() in NULL_ANSWERS:
+            return None
+        if path == "patient_age" and value.isdigit():
+            return int(value)
+        return value
+
+    def reextract(self, llava_model, image_path, data, fields):
+        """
+        Re-read the given fields and merge the answers into a copy of the record
+
+        Args:
+            llava_model: LlavaExtractor (or compatible) to query
+            image_path: Path to prescription image
+            data: Formatted first-pass prescription data
+            fields: Field paths to re-read, e.g. "medication_list[0].dosage"
+
+        Returns:
+            Tuple of (merged data, list of replaced fields, list of fields that could not be read)
+        """
+        self.stats['prescriptions'] += 1
+        merged = copy.deepcopy(data)
+        replaced, unresolved = [], []
+
+        for path in fields:
+            prompt = self._prompt_for(data, path)
+            limit = 4 * self.max_new_tokens if path.endswith("]") else self.max_new_tokens
+            answer = llava_model.extract_prescription_data(image_path, prompt, max_new_tokens=limit)
+            self.stats['field_prompts'] += 1
+
+            value = self._parse_answer(path, answer)
+            if value is not None and set_field(merged, path, value):
+                replaced.append(path)
+            else:
+                unresolved.append(path)
+
+        self.stats['fields_replaced'] += len(replaced)
+        self.stats['fields_unresolved'] += len(unresolved)
+        return merged, replaced, unresolved
@@ -1,72 +1,403 @@
 # model/llava_interface.py
 
+import copy
+import time
 import torch
-from PIL import Image
+from PIL import Image, ImageOps
 import requests
 from io import BytesIO
-from transformers import AutoProcessor, LlavaForConditionalGeneration
+from transformers import AutoProcessor
+
+from src.instrumentation.tracing import NULL_TRACER
+from src.model.model_loading import load_llava_model
+from src.model.prompt_templates import LLAVA_PROMPT_HEAD, format_llava_prompt, get_static_prompt_prefixes
+from src.runtime.http_fetch import is_url
+
+class PrefixCacheEntry:
+    def __init__(self, input_ids, past_key_values, prefill_s):
+        """
+        Key/value states for a constant prompt prefix
+
+        Args:
+            input_ids: Token ids covered by the cache (1-D tensor)
+            past_key_values: Cache returned by the prefix forward pass
+            prefill_s: Time it took to prefill the prefix
+        """
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.prefill_s = prefill_s
 
 class LlavaExtractor:
-    def __init__(self, model_name="llava-hf/llava-1.5-13b-hf"):
+    def __init__(self, model_name="llava-hf/llava-1.5-13b-hf", tracer=None, prefix_cache=True,
+                 max_memory=None, offload_folder=None, low_memory=False, fetcher=None,
+                 draft_model_name=None, num_draft_tokens=None, prompt_lookup_tokens=None, image_budget=None):
         """
         Initialize LLaVA model for prescription extraction
-        
+
         Args:
             model_name: HuggingFace model name for LLaVA
+            tracer: Tracer for per-stage instrumentation (optional)
+            prefix_cache: Reuse key/value states of the constant prompt prefixes
+            max_memory: Memory budget for the model, e.g. "24GiB"; the rest is offloaded to disk (optional)
+            offload_folder: Directory for layers offloaded to disk (optional)
+            low_memory: Stream weights into place without a transient full copy
+            fetcher: ImageFetcher used for URL inputs (optional)
+            draft_model_name: Smaller LLaVA model sharing the tokenizer, used to draft tokens
+                for speculative decoding (optional)
+            num_draft_tokens: Initial number of tokens the draft model proposes per step (optional)
+            prompt_lookup_tokens: Draft by copying this many tokens from matching spans of the
+                prompt instead of using a draft model (optional)
+            image_budget: ImageTokenBudget choosing a single crop or tiles per prescription (optional)
         """
+        self.tracer = tracer or NULL_TRACER
+        self.fetcher = fetcher
+        self.image_budget = image_budget
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.processor = AutoProcessor.from_pretrained(model_name)
-        self.model = LlavaForConditionalGeneration.from_pretrained(
-            model_name, 
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
-        ).to(self.device)
-        
+        with self.tracer.span("llava.load_model", model=model_name):
+            self.processor = AutoProcessor.from_pretrained(model_name)
+            self.model, self.load_stats = load_llava_model(
+                model_name,
+                self.device,
+                max_memory=max_memory,
+                offload_folder=offload_folder,
+                low_memory=low_memory,
+                tracer=self.tracer
+            )
+
+            self.draft_model = None
+            if draft_model_name is not None:
+                self.draft_model, _ = load_llava_model(draft_model_name, self.device, tracer=self.tracer)
+
         # Set max length for generation
         self.max_length = 1024
-        
+
+        # Speculative decoding state; drafts are checked by the full model, so output matches greedy decoding
+        self.prompt_lookup_tokens = prompt_lookup_tokens
+        self._draft_pixel_values = None
+        self._forward_counts = {'target': 0, 'draft': 0}
+        self.model.register_forward_pre_hook(self._count_forward('target'))
+        if self.draft_model is not None:
+            target_vocab = self.model.config.get_text_config().vocab_size
+            draft_vocab = self.draft_model.config.get_text_config().vocab_size
+            if draft_vocab != target_vocab:
+                raise ValueError(f"Draft model vocabulary ({draft_vocab}) does not match the model's ({target_vocab})")
+            if num_draft_tokens is not None:
+                self.draft_model.generation_config.num_assistant_tokens = num_draft_tokens
+            self.draft_model.register_forward_pre_hook(self._count_forward('draft'))
+            self.draft_model.register_forward_pre_hook(self._inject_draft_image, with_kwargs=True)
+        self.speculation_stats = {
+            'generations': 0,
+            'generated_tokens': 0,
+            'target_forwards': 0,
+            'draft_forwards': 0,
+            'generate_s': 0.0
+        }
+
+        # Per-image token and latency usage, kept while an image budget is in use
+        self.usage = {}
+
+        # Prefix caching state
+        self.prefix_cache = prefix_cache
+        self.static_prefixes = get_static_prompt_prefixes()
+        self._prefix_entries = {}
+        self.prefix_cache_stats = {
+            'hits': 0,
+            'misses': 0,
+            'cached_tokens': 0,
+            'prefill_time_saved_s': 0.0
+        }
+
     def load_image(self, image_path_or_url):
         """Load image from path or URL"""
-        if image_path_or_url.startswith(('http://', 'https://')):
-            response = requests.get(image_path_or_url)
-            image = Image.open(BytesIO(response.content))
+        if is_url(image_path_or_url):
+            if self.fetcher is not None:
+                # Served from the fetcher's cache after the first request
+                image = Image.open(self.fetcher.fetch(image_path_or_url))
+            else:
+                response = requests.get(image_path_or_url, timeout=(5, 30))
+                response.raise_for_status()
+                image = Image.open(BytesIO(response.content))
         else:
             image = Image.open(image_path_or_url)
-        
-        return image
-    
-    def extract_prescription_data(self, image_path_or_url, prompt_template):
+
+        # Apply the EXIF orientation like cv2.imread does, so image budget crop
+        # boxes planned on the enhanced image land on the same pixels
+        return ImageOps.exif_transpose(image)
+
+    @property
+    def speculative(self):
+        """Whether generation drafts tokens ahead of the full model"""
+        return self.draft_model is not None or self.prompt_lookup_tokens is not None
+
+    def _count_forward(self, name):
+        """Forward pre-hook counting passes of the target or draft model"""
+        def hook(module, args):
+            self._forward_counts[name] += 1
+        return hook
+
+    def _inject_draft_image(self, module, args, kwargs):
+        """
+        Forward pre-hook giving the draft model the image on its prefill
+
+        Assisted generation drops pixel_values from the draft model's inputs,
+        which would leave it drafting blind and have nearly every proposal
+        rejected.
+        """
+        cache = kwargs.get("past_key_values")
+        if (self._draft_pixel_values is not None and kwargs.get("pixel_values") is None
+                and (cache is None or cache.get_seq_length() == 0)):
+            kwargs["pixel_values"] = self._draft_pixel_values
+        return args, kwargs
+
+    def speculation_summary(self):
+        """
+        Summarize speculative decoding efficiency
+
+        Every full-model pass during generation yields one token of its own
+        plus the draft tokens it accepted, so tokens per full-model pass is
+        the reduction in sequential full-model steps over greedy decoding.
+
+        Returns:
+            Dictionary with token counts, tokens per full-model pass and, with a
+            draft model, the fraction of drafted tokens that were accepted
+        """
+        stats = self.speculation_stats
+        accepted = max(stats['generated_tokens'] - stats['target_forwards'], 0)
+        return {
+            **stats,
+            'accepted_tokens': accepted,
+            'tokens_per_target_forward': (stats['generated_tokens'] / stats['target_forwards']
+                                          if stats['target_forwards'] else 0.0),
+            'acceptance_rate': (accepted / stats['draft_forwards']
+                                if self.draft_model is not None and stats['draft_forwards'] else None)
+        }
+
+    def pop_usage(self, image_path_or_url):
+        """
+        Return and clear the token and latency usage recorded for an image
+
+        Returns:
+            Usage dictionary, or None if nothing was recorded
+        """
+        return self.usage.pop(image_path_or_url, None)
+
+    def _record_usage(self, image_path_or_url, plan, inputs, generated_tokens, elapsed):
+        """Accumulate per-image usage across the calls made for one prescription"""
+        image_tokens = int((inputs["input_ids"] == self.model.config.image_token_id).sum())
+        usage = self.usage.setdefault(image_path_or_url, {
+            'tiles': len(plan["tiles"]),
+            'grid': list(plan["grid"]),
+            'text_lines': plan["text_lines"],
+            'line_height': plan["line_height"],
+            'ink_ratio': plan["ink_ratio"],
+            'calls': 0,
+            'image_tokens': 0,
+            'prompt_tokens': 0,
+            'generated_tokens': 0,
+            'model_s': 0.0
+        })
+        usage['calls'] += 1
+        usage['image_tokens'] += image_tokens
+        usage['prompt_tokens'] += inputs["input_ids"].shape[1]
+        usage['generated_tokens'] += generated_tokens
+        usage['model_s'] += elapsed
+
+    def _matching_prefix(self, prompt_template):
+        """Return the longest registered static prefix the prompt starts with"""
+        matches = [p for p in self.static_prefixes if prompt_template.startswith(p)]
+        return max(matches, key=len) if matches else None
+
+    def _get_prefix_entry(self, prefix, input_ids):
+        """
+        Get or build the cache entry for a static prefix
+
+        The prefix is tokenized on its own and only the tokens that agree with
+        the full prompt's tokenization are cached, so token merges at the
+        prefix boundary never leak into the cache.
+
+        Args:
+            prefix: Static instruction prefix
+            input_ids: Token ids of the full prompt (1-D tensor)
+
+        Returns:
+            PrefixCacheEntry, or None if nothing can be cached
+        """
+        if prefix in self._prefix_entries:
+            return self._prefix_entries[prefix]
+
+        prefix_ids = self.processor.tokenizer(
+            LLAVA_PROMPT_HEAD + prefix, return_tensors="pt"
+        )["input_ids"][0].to(input_ids.device)
+
+        length = min(len(prefix_ids), len(input_ids))
+        mismatch = (prefix_ids[:length] != input_ids[:length]).nonzero()
+        common = int(mismatch[0]) if len(mismatch) else length
+        if common == 0:
+            return None
+
+        cached_ids = input_ids[:common]
+        start = time.perf_counter()
+        with self.tracer.span("llava.prefix_prefill", tokens=common), torch.no_grad():
+            outputs = self.model(input_ids=cached_ids.unsqueeze(0), use_cache=True)
+        entry = PrefixCacheEntry(cached_ids, outputs.past_key_values, time.perf_counter() - start)
+        self._prefix_entries[prefix] = entry
+
+        return entry
+
+    def _prefill_from_prefix(self, inputs, prompt_template):
+        """
+        Prefill the prompt starting from a cached static prefix
+
+        Everything after the cached prefix except the final token (including
+        the image) is run through the model here; generate() then sees a cache
+        covering all but one prompt token and starts decoding from it.
+
+        Args:
+            inputs: Processor outputs for the full prompt
+            prompt_template: Instruction prompt
+
+        Returns:
+            Tuple of (cache to pass to generate() or None for a full prefill, number of cached tokens)
+        """
+        # Assisted generation prefills the draft and target together, so it starts from an empty cache
+        if not self.prefix_cache or self.speculative:
+            return None, 0
+
+        prefix = self._matching_prefix(prompt_template)
+        if prefix is None:
+            return None, 0
+
+        input_ids = inputs["input_ids"]
+        reused = prefix in self._prefix_entries
+        entry = self._get_prefix_entry(prefix, input_ids[0])
+        cached = len(entry.input_ids) if entry is not None else 0
+        image_positions = (input_ids[0] == self.model.config.image_token_id).nonzero()
+        first_image = int(image_positions[0]) if len(image_positions) else input_ids.shape[1]
+
+        # The cache must match the prompt and stop before the image tokens and the last token
+        if (entry is None or cached > first_image or cached >= input_ids.shape[1] - 1
+                or not torch.equal(entry.input_ids, input_ids[0, :cached])):
+            self.prefix_cache_stats['misses'] += 1
+            return None, 0
+
+        past_key_values = copy.deepcopy(entry.past_key_values)
+        with torch.no_grad():
+            self.model(
+                input_ids=input_ids[:, cached:-1],
+                pixel_values=inputs["pixel_values"],
+                attention_mask=inputs["attention_mask"][:, :-1],
+                past_key_values=past_key_values,
+                cache_position=torch.arange(cached, input_ids.shape[1] - 1, device=input_ids.device),
+                use_cache=True
+            )
+
+        self.prefix_cache_stats['hits'] += 1
+        self.prefix_cache_stats['cached_tokens'] += cached
+        if reused:
+            self.prefix_cache_stats['prefill_time_saved_s'] += entry.prefill_s
+
+        return past_key_values, cached
+
+    def extract_prescription_data(self, image_path_or_url, prompt_template, max_new_tokens=None):
         """
         Extract structured data from prescription image
-        
+
         Args:
             image_path_or_url: Path or URL to prescription image
             prompt_template: Instruction prompt for extraction
-            
+            max_new_tokens: Limit on generated tokens (optional, otherwise up to max_length in total)
+
         Returns:
             Extracted text from the model
         """
+        call_start = time.perf_counter()
+
         # Load and prepare image
-        image = self.load_image(image_path_or_url)
-        
+        with self.tracer.span("llava.load_image"):
+            image = self.load_image(image_path_or_url)
+
+        # Crop or tile the image according to how much text it holds
+        plan = None
+        images = [image]
+        if self.image_budget is not None:
+            with self.tracer.span("llava.image_budget") as span:
+                images, plan = self.image_budget.prepare(image_path_or_url, image)
+                span.set(tiles=len(images), text_lines=plan["text_lines"])
+
         # Process inputs
-        inputs = self.processor(
-            prompt_template,
-            image,
-            return_tensors="pt"
-        ).to(self.device)
-        
+        with self.tracer.span("llava.preprocess"):
+            inputs = self.processor(
+                text=format_llava_prompt(prompt_template, num_images=len(images)),
+                images=images,
+                return_tensors="pt"
+            ).to(self.device)
+        prompt_tokens = inputs["input_ids"].shape[1]
+
+        # Prefill from the cached static prefix where possible
+        with self.tracer.span("llava.prefill") as span:
+            past_key_values, cached_tokens = self._prefill_from_prefix(inputs, prompt_template)
+            span.set(cached_tokens=cached_tokens)
+
+        # Draft tokens ahead of the model where configured
+        speculation = {}
+        if self.draft_model is not None:
+            speculation["assistant_model"] = self.draft_model
+            self._draft_pixel_values = inputs["pixel_values"]
+        elif self.prompt_lookup_tokens is not None:
+            speculation["prompt_lookup_num_tokens"] = self.prompt_lookup_tokens
+
+        # Bound the response length
+        if max_new_tokens is not None:
+            length_limit = {"max_new_tokens": max_new_tokens}
+        elif len(images) > 1:
+            # Tiled prompts get the answer budget of the single-image prompt, so tiles never eat into it
+            tokens_per_tile = int((inputs["input_ids"] == self.model.config.image_token_id).sum()) // len(images)
+            single_prompt_tokens = self.processor.tokenizer(
+                format_llava_prompt(prompt_template), return_tensors="pt"
+            )["input_ids"].shape[1] + tokens_per_tile - 1
+            length_limit = {"max_new_tokens": max(self.max_length - single_prompt_tokens, 1)}
+        else:
+            length_limit = {"max_length": self.max_length}
+
         # Generate response
-        with torch.no_grad():
-            output = self.model.generate(
-                **inputs,
-                max_length=self.max_length,
-                do_sample=False
-            )
-        
-        # Decode and return generated text
-        response = self.processor.decode(output[0], skip_special_tokens=True)
-        
-        # Extract only the model's response (remove the prompt)
-        response = response.split(prompt_template)[-1].strip()
-        
-        return response
\ No newline at end of file
+        forwards_before = dict(self._forward_counts)
+        start = time.perf_counter()
+        with self.tracer.span("llava.generate") as span, torch.no_grad():
+            try:
+                if past_key_values is not None:
+                    output = self.model.generate(
+                        input_ids=inputs["input_ids"],
+                        attention_mask=inputs["attention_mask"],
+                        past_key_values=past_key_values,
+                        do_sample=False,
+                        **length_limit,
+                        **speculation
+                    )
+                else:
+                    output = self.model.generate(
+                        **inputs,
+                        do_sample=False,
+                        **length_limit,
+                        **speculation
+                    )
+            finally:
+                self._draft_pixel_values = None
+            generated_tokens = output.shape[1] - prompt_tokens
+            target_forwards = self._forward_counts['target'] - forwards_before['target']
+            span.set(prompt_tokens=prompt_tokens, generated_tokens=generated_tokens,
+                     target_forwards=target_forwards)
+
+        self.speculation_stats['generations'] += 1
+        self.speculation_stats['generated_tokens'] += generated_tokens
+        self.speculation_stats['target_forwards'] += target_forwards
+        self.speculation_stats['draft_forwards'] += self._forward_counts['draft'] - forwards_before['draft']
+        self.speculation_stats['generate_s'] += time.perf_counter() - start
+
+        # Decode only the generated tokens, dropping the prompt
+        with self.tracer.span("llava.decode"):
+            response = self.processor.decode(output[0][prompt_tokens:], skip_special_tokens=True)
+
+        if plan is not None:
+            self._record_usage(image_path_or_url, plan, inputs, generated_tokens, time.perf_counter() - call_start)
+
+        return response.strip()
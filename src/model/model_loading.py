@@ -0,0 +1,69 @@
+# model/model_loading.py
+
+import os
+import time
+import tempfile
+import torch
+from transformers import LlavaForConditionalGeneration
+
+from src.instrumentation.tracing import NULL_TRACER, RssPeakSampler
+
+def load_llava_model(model_name, device, max_memory=None, offload_folder=None, low_memory=False, tracer=None):
+    """
+    Load LLaVA weights, optionally under a memory budget
+
+    The default path matches the original behaviour: load the full model and
+    move it to the device. In low-memory mode weights are streamed from the
+    memory-mapped safetensors shards straight into their final placement,
+    so no transient full copy is held; with a max_memory budget, layers that
+    do not fit are offloaded to disk and paged in during the forward pass.
+
+    Args:
+        model_name: HuggingFace model name or local path
+        device: "cuda" or "cpu"
+        max_memory: Memory budget for the model on the device, e.g. "24GiB" (optional)
+        offload_folder: Directory for layers offloaded to disk (optional)
+        low_memory: Stream weights without a transient full copy even without a budget
+        tracer: Tracer for instrumentation (optional)
+
+    Returns:
+        Tuple of (model, load statistics dictionary)
+    """
+    tracer = tracer or NULL_TRACER
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    start = time.perf_counter()
+
+    # Sample RSS during the load itself; the process-lifetime peak would still
+    # show an earlier model's load when a second model is loaded
+    with tracer.span("llava.load_weights", model=model_name, max_memory=max_memory), RssPeakSampler() as rss:
+        if max_memory is None and not low_memory:
+            model = LlavaForConditionalGeneration.from_pretrained(
+                model_name,
+                torch_dtype=dtype
+            ).to(device)
+        else:
+            kwargs = {"torch_dtype": dtype, "low_cpu_mem_usage": True}
+            if max_memory is not None:
+                offload_folder = offload_folder or os.path.join(tempfile.gettempdir(), "llava_offload")
+                os.makedirs(offload_folder, exist_ok=True)
+                kwargs["device_map"] = "auto"
+                kwargs["max_memory"] = {0: max_memory} if device == "cuda" else {"cpu": max_memory}
+                kwargs["offload_folder"] = offload_folder
+            elif device == "cuda":
+                # Place weights on the GPU as they are read instead of staging them in RAM
+                kwargs["device_map"] = {"": device}
+            model = LlavaForConditionalGeneration.from_pretrained(model_name, **kwargs)
+
+    stats = {
+        "load_s": time.perf_counter() - start,
+        "peak_rss_mb": rss.peak_mb,
+        "rss_before_load_mb": rss.start_mb,
+        "rss_after_load_mb": rss.end_mb,
+        "max_memory": max_memory,
+        "offloaded_modules": sorted(
+            name for name, placement in (getattr(model, "hf_device_map", None) or {}).items()
+            if placement == "disk"
+        )
+    }
+
+    return model, stats
@@ -1,5 +1,8 @@
 # model/prompt_templates.py
 
+# Start of every LLaVA-1.5 conversation turn
+LLAVA_PROMPT_HEAD = "USER: "
+
 def get_extraction_prompt():
     """
     Returns a prompt template for extracting prescription information
@@ -28,32 +31,132 @@ def get_extraction_prompt():
     
     return prompt.strip()
 
+def get_verification_instructions():
+    """
+    Returns the constant preamble of the verification prompt
+    
+    It is kept separate from the extracted text so the model can reuse the
+    cached key/value states for it on every request.
+    """
+    prompt = """
+    Please verify the information below, which was extracted from this medical prescription, and correct any errors you can identify. Pay special attention to:
+    1. Medical terminology and drug names
+    2. Dosage amounts and units
+    3. Frequency instructions
+    4. Missing critical information
+    
+    If any information is clearly wrong or implausible for a medical prescription, please fix it.
+    Return the corrected information in the same JSON format.
+    """
+    
+    return prompt.strip()
+
 def get_verification_prompt(extracted_text):
     """
     Creates a verification prompt with the extracted text to double-check accuracy
     
+    The constant instructions come first and the extracted text last, so the
+    instruction block is a shared prefix across all verification requests.
+    
     Args:
         extracted_text: The text extracted in the first pass
     
     Returns:
         Verification prompt string
     """
-    prompt = f"""
-    I've extracted the following information from a medical prescription:
+    prompt = f"""{get_verification_instructions()}
+
+Extracted information:
+{extracted_text}"""
     
-    {extracted_text}
+    return prompt
+
+# What each field holds, as worded in the extraction prompt
+FIELD_DESCRIPTIONS = {
+    "patient_name": "full name of the patient",
+    "patient_age": "age of the patient",
+    "patient_gender": "gender of the patient",
+    "diagnosis": "medical condition being treated",
+    "doctor_name": "name of the prescribing doctor",
+    "doctor_credentials": "qualifications or specialization of the doctor",
+    "date": "date when the prescription was written",
+    "hospital/clinic": "name of the hospital or clinic",
+    "name": "name of the medication",
+    "dosage": "amount to be taken (e.g., \"10mg\", \"1 tablet\")",
+    "route": "how the medication should be taken (e.g., \"oral\", \"topical\")",
+    "frequency": "how often to take it (e.g., \"twice daily\", \"every 8 hours\")",
+    "duration": "how long to take it (e.g., \"7 days\", \"2 weeks\")",
+    "special_instructions": "additional notes on how to take the medication"
+}
+
+def get_field_instructions():
+    """
+    Returns the constant preamble of the field re-extraction prompts
+    """
+    prompt = """
+    Read a single item from this medical prescription. Answer with the value exactly as written and nothing else.
+    If the item is not present or not legible, answer null.
+    """
     
-    Please verify this information and correct any errors you can identify. Pay special attention to:
-    1. Medical terminology and drug names
-    2. Dosage amounts and units
-    3. Frequency instructions
-    4. Missing critical information
+    return prompt.strip()
+
+def get_field_extraction_prompt(field, medication_number=None, medication_name=None):
+    """
+    Creates a short prompt asking for one field of the prescription
     
-    If any information is clearly wrong or implausible for a medical prescription, please fix it.
-    Return the corrected information in the same JSON format.
+    Args:
+        field: Field name, e.g. "doctor_name" or "dosage"
+        medication_number: 1-based position of the medication for medication fields (optional)
+        medication_name: Name already read for that medication, to anchor the model (optional)
+        
+    Returns:
+        Field extraction prompt string
     """
+    item = FIELD_DESCRIPTIONS.get(field, field.replace('_', ' '))
+    if medication_number is not None:
+        medication = f"medication {medication_number}"
+        if medication_name:
+            medication += f" ({medication_name})"
+        if field == "medication":
+            item = (f"complete entry for {medication} as a JSON object with name, dosage, route, "
+                    f"frequency, duration and special_instructions")
+        else:
+            item = f"{item} for {medication}"
     
-    return prompt.strip()
+    prompt = f"""{get_field_instructions()}
+
+Item: {item}"""
+    
+    return prompt
+
+def get_static_prompt_prefixes():
+    """
+    Returns the prompt segments that are identical for every request
+    
+    LlavaExtractor computes the key/value cache for these once per process.
+    """
+    return [get_extraction_prompt(), get_verification_instructions(), get_field_instructions()]
+
+def format_llava_prompt(instruction, num_images=1):
+    """
+    Wraps an instruction in the LLaVA-1.5 conversation format
+    
+    The image placeholder goes after the instruction so that any constant
+    instruction text forms a prefix shared between requests.
+    
+    Args:
+        instruction: Instruction prompt
+        num_images: Number of image placeholders, one per tile of a tiled prescription
+        
+    Returns:
+        Prompt string for the LLaVA processor
+    """
+    if num_images == 1:
+        images = "<image>"
+    else:
+        images = (f"The prescription is shown as {num_images} overlapping tiles, "
+                  f"left to right and top to bottom.\n" + "\n".join(["<image>"] * num_images))
+    return f"{LLAVA_PROMPT_HEAD}{instruction}\n{images}\nASSISTANT:"
 
 def get_segmented_extraction_prompt(region_description):
     """
@@ -0,0 +1,90 @@
+# postprocessing/verification_policy.py
+
+import re
+
+class VerificationPolicy:
+    def __init__(self, validator, confidence_threshold=0.9, required_fields=None,
+                 required_medication_fields=None):
+        """
+        Decide whether a first-pass extraction needs the verification pass
+
+        Args:
+            validator: Initialized MedicalValidator instance
+            confidence_threshold: Minimum validator confidence to skip verification
+            required_fields: Top-level fields that must be present to skip verification
+            required_medication_fields: Fields every medication must have to skip verification
+        """
+        self.validator = validator
+        self.confidence_threshold = confidence_threshold
+        self.required_fields = required_fields or ["patient_name", "medication_list", "doctor_name", "date"]
+        self.required_medication_fields = required_medication_fields or ["name", "dosage", "frequency"]
+
+    def _matches_any(self, value, patterns):
+        """Check a value against a list of regex patterns"""
+        return any(re.search(pattern, str(value), re.IGNORECASE) for pattern in patterns)
+
+    def find_suspect_fields(self, data):
+        """
+        List fields that are missing or fail the validator's format checks
+
+        Args:
+            data: First-pass prescription data
+
+        Returns:
+            List of field paths, e.g. "patient_name" or "medication_list[0].dosage"
+        """
+        suspect = [field for field in self.required_fields if not data.get(field)]
+
+        medications = data.get('medication_list')
+        if not isinstance(medications, list):
+            return suspect
+
+        for i, med in enumerate(medications):
+            if not isinstance(med, dict):
+                suspect.append(f"medication_list[{i}]")
+                continue
+            for field in self.required_medication_fields:
+                if not med.get(field):
+                    suspect.append(f"medication_list[{i}].{field}")
+            if med.get('dosage') and not self._matches_any(med['dosage'], self.validator.dosage_patterns):
+                suspect.append(f"medication_list[{i}].dosage")
+            if med.get('frequency') and not self._matches_any(med['frequency'], self.validator.frequency_patterns):
+                suspect.append(f"medication_list[{i}].frequency")
+
+        # Keep order but drop duplicates from overlapping checks
+        return list(dict.fromkeys(suspect))
+
+    def assess(self, data):
+        """
+        Score a first-pass extraction and decide whether to verify it
+
+        Args:
+            data: First-pass prescription data from JsonFormatter.format_response
+
+        Returns:
+            Dictionary with the decision, confidence, suspect fields and reasons
+        """
+        if "error" in data:
+            return {
+                'verify': True,
+                'confidence': 0.0,
+                'suspect_fields': [],
+                'reasons': [f"First pass did not parse: {data['error']}"]
+            }
+
+        validated = self.validator.validate_prescription(data)
+        confidence = validated['validation']['overall_confidence']
+        suspect_fields = self.find_suspect_fields(data)
+
+        reasons = []
+        if confidence < self.confidence_threshold:
+            reasons.append(f"Confidence {confidence} below threshold {self.confidence_threshold}")
+        if suspect_fields:
+            reasons.append(f"Suspect fields: {', '.join(suspect_fields)}")
+
+        return {
+            'verify': bool(reasons),
+            'confidence': confidence,
+            'suspect_fields': suspect_fields,
+            'reasons': reasons
+        }
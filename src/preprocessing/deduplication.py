@@ -0,0 +1,480 @@
+# preprocessing/deduplication.py
+
+import os
+import json
+import difflib
+import cv2
+import numpy as np
+
+from src.preprocessing.image_budget import find_text_lines
+
+SIGNATURE_SIDE = 1600
+
+def drop_non_text(binary_image, min_area=16):
+    """
+    Remove page edges, ruled lines, their fragments and binarization specks
+
+    These come and go with framing, lighting and sensor noise between
+    photographs of the same sheet, so they must not count as content.
+
+    Args:
+        binary_image: Binarized image (ink is non-zero)
+        min_area: Components with fewer pixels are specks
+
+    Returns:
+        Binarized image without long, thin or tiny components
+    """
+    height, width = binary_image.shape
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(binary_image, connectivity=8)
+    comp_w, comp_h = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+
+    drop = (comp_w > 0.5 * width) | (comp_h > 0.5 * height)
+    drop |= (comp_h >= 8 * comp_w) & (comp_h > 40)
+    drop |= (comp_w >= 6 * comp_h) & (comp_w > 24)
+    drop |= stats[:, cv2.CC_STAT_AREA] < min_area
+    drop[0] = False
+    return np.where(drop[labels], 0, binary_image).astype(np.uint8)
+
+def text_mask(binary_image, min_density=0.3):
+    """
+    Mask of the words on a binarized scan
+
+    Ink is closed into word blobs; blobs that are too small, too tall or too
+    sparse to be words are dropped, as are blob clusters far from the body of
+    text (leftover edges and stains).
+
+    Args:
+        binary_image: Output of drop_non_text
+        min_density: Minimum fraction of a word blob covered by ink
+
+    Returns:
+        Boolean mask of the same shape
+    """
+    height = binary_image.shape[0]
+    blobs = cv2.morphologyEx(binary_image, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 7)))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(blobs, connectivity=8)
+    blob_w, blob_h = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    ink = np.bincount(labels.ravel(), weights=(binary_image > 0).ravel(), minlength=count)
+
+    # Density is measured against the blob, not its bounding box, so slanted lines pass
+    words = ((blob_h >= 10) & (blob_h <= 0.1 * height) & (blob_w >= 12) & (blob_h <= 2 * blob_w)
+             & (ink >= min_density * stats[:, cv2.CC_STAT_AREA]))
+    words[0] = False
+    mask = words[labels]
+
+    clusters = cv2.dilate(mask.astype(np.uint8), cv2.getStructuringElement(cv2.MORPH_RECT, (81, 101)))
+    count, labels, _, _ = cv2.connectedComponentsWithStats(clusters, connectivity=8)
+    text = np.bincount(labels.ravel(), weights=mask.ravel(), minlength=count)
+    text[0] = 0
+    return mask & (text >= 0.1 * text.max())[labels]
+
+def skew_angle(mask, max_angle=5.0, step=0.25):
+    """
+    Rotation in degrees that makes text rows horizontal
+
+    Chosen by maximizing the variance of the row profile, which peaks when
+    lines and the gaps between them are separated cleanly.
+    """
+    height, width = mask.shape
+    scale = 400 / max(height, width)
+    small = cv2.resize(mask.astype(np.uint8) * 255, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                       interpolation=cv2.INTER_AREA)
+    center = (small.shape[1] / 2, small.shape[0] / 2)
+
+    best_variance, best_angle = -1.0, 0.0
+    for angle in np.arange(-max_angle, max_angle + step, step):
+        rotated = cv2.warpAffine(small, cv2.getRotationMatrix2D(center, angle, 1.0), (small.shape[1], small.shape[0]))
+        variance = rotated.sum(axis=1).astype(np.float64).var()
+        if variance > best_variance:
+            best_variance, best_angle = variance, float(angle)
+    return best_angle
+
+def layout_hash(mask, hash_size=16, highfreq_factor=4):
+    """
+    DCT hash of a text mask
+
+    The hash only describes where text sits on the page; it is used to find
+    candidates, and cannot tell apart prescriptions written on the same
+    template.
+
+    Args:
+        mask: Deskewed text mask cropped to its content
+        hash_size: Side of the low-frequency DCT block; the hash has hash_size**2 bits
+        highfreq_factor: Downscale size relative to hash_size before the DCT
+
+    Returns:
+        Hash as a Python int
+    """
+    size = hash_size * highfreq_factor
+    small = cv2.resize(mask.astype(np.float32), (size, size), interpolation=cv2.INTER_AREA)
+    dct = cv2.dct(small)[:hash_size, :hash_size]
+
+    # Compare against the median, leaving out the DC term which only encodes ink density
+    median = np.median(dct.flatten()[1:])
+    bits = (dct > median).flatten()
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def text_signature(binary_image, hash_size=16):
+    """
+    Extract the text content of a binarized prescription for duplicate detection
+
+    Args:
+        binary_image: Output of enhance_prescription (ink is non-zero)
+        hash_size: Side of the DCT block used for the layout hash
+
+    Returns:
+        Dictionary with content (binarized text crop at a fixed scale) and hash
+    """
+    height, width = binary_image.shape
+    scale = SIGNATURE_SIDE / max(height, width)
+    binary = cv2.resize(binary_image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    binary = drop_non_text(((cv2.medianBlur(binary, 3) > 127) * 255).astype(np.uint8))
+
+    mask = text_mask(binary)
+    ys, xs = np.where(mask)
+    if len(ys) == 0:
+        return {"content": np.zeros((0, 0), np.uint8), "hash": 0}
+
+    # Percentile bounds keep a stray blob from stretching the crop
+    margin = 16
+    y_lo, y_hi = np.percentile(ys, [0.5, 99.5])
+    x_lo, x_hi = np.percentile(xs, [0.5, 99.5])
+    y0, y1 = max(int(y_lo) - margin, 0), min(int(y_hi) + 1 + margin, binary.shape[0])
+    x0, x1 = max(int(x_lo) - margin, 0), min(int(x_hi) + 1 + margin, binary.shape[1])
+    content = np.where(mask, binary, 0)[y0:y1, x0:x1].astype(np.uint8)
+    mask = mask[y0:y1, x0:x1]
+
+    # Only the hash is deskewed; comparison aligns the content itself
+    rows, cols = mask.shape
+    rotation = cv2.getRotationMatrix2D((cols / 2, rows / 2), skew_angle(mask), 1.0)
+    level = cv2.warpAffine(mask.astype(np.uint8), rotation, (cols, rows)) > 0
+    ys, xs = np.where(level)
+    if len(ys):
+        level = level[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+
+    return {"content": content, "hash": layout_hash(level, hash_size)}
+
+def align_content(reference, other, min_inliers=20):
+    """
+    Warp one text crop onto another
+
+    Feature matches give a similarity transform, refined to a sub-pixel affine
+    transform by ECC on the blurred crops.
+
+    Args:
+        reference: Content of the first signature
+        other: Content of the second signature
+
+    Returns:
+        Tuple of (warped binarized crop, mask of pixels covered by it), or None
+        if the crops do not show the same page
+    """
+    orb = cv2.ORB_create(3000)
+    ref_points, ref_desc = orb.detectAndCompute(reference, None)
+    other_points, other_desc = orb.detectAndCompute(other, None)
+    if ref_desc is None or other_desc is None or len(ref_points) < 10 or len(other_points) < 10:
+        return None
+
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(other_desc, ref_desc)
+    if len(matches) < min_inliers:
+        return None
+    src = np.float32([other_points[m.queryIdx].pt for m in matches])
+    dst = np.float32([ref_points[m.trainIdx].pt for m in matches])
+    matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if matrix is None or inliers.sum() < min_inliers:
+        return None
+    matrix = matrix.astype(np.float32)
+
+    try:
+        blurred_ref = cv2.GaussianBlur(reference.astype(np.float32) / 255, (0, 0), 1.5)
+        blurred_other = cv2.GaussianBlur(other.astype(np.float32) / 255, (0, 0), 1.5)
+        _, inverse = cv2.findTransformECC(blurred_ref, blurred_other, cv2.invertAffineTransform(matrix),
+                                          cv2.MOTION_AFFINE,
+                                          (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50, 1e-4), None, 1)
+        matrix = cv2.invertAffineTransform(inverse)
+    except cv2.error:
+        # ECC did not converge; the feature-based transform is still usable
+        pass
+
+    size = (reference.shape[1], reference.shape[0])
+    warped = cv2.warpAffine(other, matrix, size, flags=cv2.INTER_LINEAR)
+    covered = cv2.warpAffine(np.full(other.shape, 255, np.uint8), matrix, size, flags=cv2.INTER_NEAREST)
+    return ((warped > 127) * 255).astype(np.uint8), covered
+
+def unmatched_ink(image, other, tolerance):
+    """Ink pixels of image further than tolerance pixels from any ink in other"""
+    distance = cv2.distanceTransform(255 - other, cv2.DIST_L2, 3)
+    return (image > 0) & (distance > tolerance)
+
+def compare_content(reference, other, tolerance=1.5):
+    """
+    Score how closely two text crops show the same writing
+
+    After alignment, ink present in one crop but not near ink in the other is
+    counted in glyph-sized windows along each text line. The score is driven by
+    the worst window, so a single changed digit lowers it as much as a page of
+    changes would; whole-page averages hide exactly the edits that matter.
+
+    Args:
+        reference: Content of the first signature
+        other: Content of the second signature
+        tolerance: Distance in pixels within which ink counts as matched
+
+    Returns:
+        Score in [0, 1]: 1 minus the largest mismatched ink fraction of any window
+    """
+    if reference.size == 0 or other.size == 0:
+        return 0.0
+    aligned = align_content(reference, other)
+    if aligned is None:
+        return 0.0
+    warped, covered = aligned
+
+    # Ink outside the other scan's frame is not evidence of a change
+    covered = cv2.erode(covered, np.ones((5, 5), np.uint8)) > 0
+    mismatch = (unmatched_ink(reference, warped, tolerance) & covered) | unmatched_ink(warped, reference, tolerance)
+    mismatch = cv2.morphologyEx(mismatch.astype(np.uint8), cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+    ink = (reference > 0) | (warped > 0)
+    lines = find_text_lines(ink.mean(axis=1) > 0.01, min_height=4, max_gap=3)
+    if not lines:
+        return 0.0
+    size = int(np.median([end - start for start, end in lines]))
+    stride = max(size // 2, 1)
+
+    worst = 0.0
+    for start, end in lines:
+        for y in range(start, max(end - size, start) + 1, stride):
+            for x in range(0, reference.shape[1], stride):
+                inked = ink[y:y + size, x:x + size].sum()
+                if inked < 0.1 * size * size:
+                    continue
+                worst = max(worst, mismatch[y:y + size, x:x + size].sum() / inked)
+
+    return round(float(max(1.0 - worst, 0.0)), 3)
+
+def normalize_name(name):
+    """Lowercase a name and keep only letters, digits and single spaces"""
+    return " ".join("".join(c if c.isalnum() else " " for c in str(name or "").lower()).split())
+
+def names_match(name1, name2, min_ratio=0.8):
+    """
+    Check whether two readings of a patient name refer to the same person
+
+    Readings of the same handwriting differ by a character or two, so names are
+    compared by similarity ratio rather than equality. Unreadable names never match.
+    """
+    name1, name2 = normalize_name(name1), normalize_name(name2)
+    if not name1 or not name2:
+        return False
+    return difflib.SequenceMatcher(None, name1, name2).ratio() >= min_ratio
+
+def hamming_distance(hash1, hash2):
+    """Number of differing bits between two hashes"""
+    return bin(hash1 ^ hash2).count('1')
+
+class BKTree:
+    def __init__(self):
+        """Burkhard-Keller tree for Hamming-distance lookups over hashes"""
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value, item):
+        """Insert a hash with an associated item"""
+        self.size += 1
+        if self.root is None:
+            self.root = (hash_value, item, {})
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (hash_value, item, {})
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """
+        Find all items within max_distance of a hash
+
+        Returns:
+            List of (distance, item) sorted by distance
+        """
+        if self.root is None:
+            return []
+
+        matches = []
+        candidates = [self.root]
+        while candidates:
+            node_hash, item, children = candidates.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            # Triangle inequality: only subtrees within the search radius can match
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    candidates.append(child)
+
+        return sorted(matches, key=lambda match: match[0])
+
+class DuplicateIndex:
+    def __init__(self, min_similarity=0.94, candidate_distance=96, max_candidates=5, hash_size=16,
+                 index_path=None):
+        """
+        Index of processed prescriptions for near-duplicate detection
+
+        The layout hash only shortlists scans of similar-looking pages; a
+        candidate is accepted after its text is aligned with the new scan and
+        compared line by line, so a prescription on the same template with a
+        different name, age or dose is not mistaken for a re-scan.
+
+        Args:
+            min_similarity: Minimum compare_content score to treat scans as duplicates
+            candidate_distance: Hamming radius of the layout hash search
+            max_candidates: Number of closest candidates whose text is compared
+            hash_size: Side of the DCT block used for the layout hash
+            index_path: JSON lines file to persist the index across runs (optional);
+                signatures are kept in a dedup_signatures directory next to it
+        """
+        self.min_similarity = min_similarity
+        self.candidate_distance = candidate_distance
+        self.max_candidates = max_candidates
+        self.hash_size = hash_size
+        self.index_path = index_path
+        self.index_dir = None
+        self.tree = BKTree()
+
+        if index_path:
+            self.index_dir = os.path.dirname(os.path.abspath(index_path))
+            if os.path.exists(index_path):
+                self._load()
+
+    def _resolve_path(self, path):
+        """
+        Absolute path of a file recorded in the index, or None
+
+        Paths are stored relative to the index file so the index stays valid
+        when a run is resumed from another working directory or the output
+        directory is moved.
+        """
+        if not path:
+            return None
+        if os.path.isabs(path):
+            return path
+        resolved = os.path.join(self.index_dir, path)
+        if not os.path.exists(resolved) and os.path.exists(path):
+            # Indexes written before paths were made relative to the index file
+            return os.path.abspath(path)
+        return resolved
+
+    def _load(self):
+        """Rebuild the tree from the persisted index, ignoring a torn last line"""
+        legacy = 0
+        with open(self.index_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not entry.get("signature_path"):
+                    # Hash-only entries cannot be verified against a new scan
+                    legacy += 1
+                    continue
+                self.tree.add(int(entry["hash"], 16), {
+                    "image_path": entry["image_path"],
+                    "result_path": self._resolve_path(entry["result_path"]),
+                    "signature_path": self._resolve_path(entry["signature_path"]),
+                    "content": None,
+                    "result": None
+                })
+        if legacy:
+            print(f"Warning: Ignoring {legacy} dedup index entries without a text signature")
+
+    def compute_signature(self, binary_image):
+        """Text signature of a binarized image using this index's settings"""
+        return text_signature(binary_image, hash_size=self.hash_size)
+
+    def _signature_content(self, item):
+        """Load a candidate's text crop, from memory or from disk"""
+        if item["content"] is None and item["signature_path"]:
+            item["content"] = cv2.imread(item["signature_path"], cv2.IMREAD_GRAYSCALE)
+        return item["content"]
+
+    def _result(self, item):
+        """Load a candidate's validated result, from memory or from disk"""
+        if item["result"] is None and item["result_path"] and os.path.exists(item["result_path"]):
+            with open(item["result_path"], 'r') as f:
+                item["result"] = json.load(f)
+        return item["result"]
+
+    def find(self, signature):
+        """
+        Find an indexed prescription with the same text as a new scan
+
+        Args:
+            signature: Output of compute_signature for the new scan
+
+        Returns:
+            Dictionary with image_path, similarity and result of the best match
+            at or above min_similarity, or None
+        """
+        best = None
+        candidates = self.tree.search(signature["hash"], self.candidate_distance)
+        for _, item in candidates[:self.max_candidates]:
+            content = self._signature_content(item)
+            if content is None:
+                continue
+            score = compare_content(content, signature["content"])
+            if score < self.min_similarity or (best is not None and score <= best[0]):
+                continue
+            if self._result(item) is not None:
+                best = (score, item)
+
+        if best is None:
+            return None
+        score, item = best
+        return {"image_path": item["image_path"], "similarity": score, "result": item["result"]}
+
+    def add(self, signature, image_path, result, result_path=None):
+        """
+        Add a processed prescription to the index
+
+        Args:
+            signature: Output of compute_signature for the scan
+            image_path: Source image path
+            result: Validated prescription data
+            result_path: Where the result is stored, used when the index is reloaded
+        """
+        signature_path = None
+        if self.index_path:
+            signature_dir = os.path.join(self.index_dir, "dedup_signatures")
+            os.makedirs(signature_dir, exist_ok=True)
+            signature_path = os.path.join(signature_dir, f"{self.tree.size:06d}.png")
+            cv2.imwrite(signature_path, signature["content"])
+        if result_path:
+            result_path = os.path.abspath(result_path)
+
+        self.tree.add(signature["hash"], {
+            "image_path": image_path,
+            "result_path": result_path,
+            "signature_path": signature_path,
+            "content": signature["content"],
+            "result": result
+        })
+
+        if self.index_path:
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps({
+                    "hash": format(signature["hash"], 'x'),
+                    "image_path": image_path,
+                    "result_path": os.path.relpath(result_path, self.index_dir) if result_path else None,
+                    "signature_path": os.path.relpath(signature_path, self.index_dir)
+                }) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
@@ -0,0 +1,180 @@
+# preprocessing/image_budget.py
+
+import math
+import cv2
+import numpy as np
+from PIL import Image
+
+from src.preprocessing.image_enhancement import enhance_image
+
+def find_text_lines(ink_rows, min_height=6, max_gap=6):
+    """
+    Find text lines in a horizontal ink profile
+
+    Args:
+        ink_rows: Boolean array, True for rows containing ink
+        min_height: Minimum line height in pixels; shorter runs are specks
+        max_gap: Runs separated by at most this many blank rows belong to one line
+
+    Returns:
+        List of (start, end) row ranges
+    """
+    edges = np.diff(np.concatenate([[0], ink_rows.astype(np.int8), [0]]))
+    runs = list(zip(np.where(edges == 1)[0], np.where(edges == -1)[0]))
+
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    return [(int(start), int(end)) for start, end in merged if end - start >= min_height]
+
+def estimate_text_density(binary_image, margin=16, min_ink=0.002, line_ink=0.01):
+    """
+    Estimate how much text a binarized prescription holds and where it is
+
+    Args:
+        binary_image: Output of enhance_prescription (ink is non-zero)
+        margin: Padding added around the detected content, in pixels
+        min_ink: Minimum fraction of ink in a row or column for it to count as content
+        line_ink: Minimum fraction of ink in a row of the content box for it to be part of a text line
+
+    Returns:
+        Dictionary with content_box (x, y, w, h), text_lines, line_height and ink_ratio
+    """
+    ink = cv2.medianBlur(binary_image, 3) > 0
+    height, width = ink.shape
+
+    ys = np.where(ink.mean(axis=1) > min_ink)[0]
+    xs = np.where(ink.mean(axis=0) > min_ink)[0]
+    if len(ys) == 0 or len(xs) == 0:
+        return {"content_box": (0, 0, width, height), "text_lines": 0, "line_height": 0, "ink_ratio": 0.0}
+
+    x0, x1 = max(int(xs[0]) - margin, 0), min(int(xs[-1]) + 1 + margin, width)
+    y0, y1 = max(int(ys[0]) - margin, 0), min(int(ys[-1]) + 1 + margin, height)
+    content = ink[y0:y1, x0:x1]
+    lines = find_text_lines(content.mean(axis=1) > line_ink)
+
+    return {
+        "content_box": (x0, y0, x1 - x0, y1 - y0),
+        "text_lines": len(lines),
+        "line_height": int(np.median([end - start for start, end in lines])) if lines else 0,
+        "ink_ratio": round(float(content.mean()), 4)
+    }
+
+def tile_grid(width, height, max_tiles):
+    """
+    Choose the tile grid that renders the content largest within a tile budget
+
+    Each tile is scaled to the vision encoder's square input, so the grid
+    minimizing the longest tile side gives the highest effective resolution.
+    Ties go to fewer tiles, then to more rows than columns, which splits
+    fewer text lines.
+
+    Returns:
+        Tuple of (columns, rows)
+    """
+    candidates = [(cols, rows) for cols in range(1, max_tiles + 1) for rows in range(1, max_tiles + 1)
+                  if cols * rows <= max_tiles]
+    return min(candidates, key=lambda grid: (max(width / grid[0], height / grid[1]), grid[0] * grid[1], grid[0]))
+
+def pad_to_square(image, fill=(255, 255, 255)):
+    """Pad an image to a square so the processor's center crop keeps all of it"""
+    side = max(image.size)
+    square = Image.new("RGB", (side, side), fill)
+    square.paste(image, ((side - image.width) // 2, (side - image.height) // 2))
+    return square
+
+class ImageTokenBudget:
+    def __init__(self, sparse_max_lines=10, lines_per_tile=6, max_tiles=4, overlap=0.1):
+        """
+        Adaptive image-token policy based on how much text a prescription holds
+
+        Sparse prescriptions are cropped to their content and sent as a single
+        image; dense ones are split into overlapping tiles, each encoded at the
+        full vision resolution, so the image-token cost grows with the text.
+
+        Args:
+            sparse_max_lines: Prescriptions with at most this many text lines get a single pass
+            lines_per_tile: Text lines per tile used to size the tile budget of dense prescriptions
+            max_tiles: Maximum number of tiles per prescription
+            overlap: Fraction of a tile shared with its neighbours, so no line is only cut in half
+        """
+        self.sparse_max_lines = sparse_max_lines
+        self.lines_per_tile = lines_per_tile
+        self.max_tiles = max_tiles
+        self.overlap = overlap
+        self._plans = {}
+
+    def register(self, key, binary_image):
+        """
+        Plan an image from its binarized version, e.g. the pipeline's enhanced image
+
+        Args:
+            key: Image path or URL the plan is used for
+            binary_image: Output of enhance_prescription for that image
+
+        Returns:
+            Plan dictionary
+        """
+        density = estimate_text_density(binary_image)
+        x, y, w, h = density["content_box"]
+
+        if density["text_lines"] <= self.sparse_max_lines:
+            grid = (1, 1)
+        else:
+            budget = min(self.max_tiles, math.ceil(density["text_lines"] / self.lines_per_tile))
+            grid = tile_grid(w, h, budget)
+
+        cols, rows = grid
+        tile_w, tile_h = w / cols, h / rows
+        pad_w, pad_h = (tile_w * self.overlap / 2 if cols > 1 else 0), (tile_h * self.overlap / 2 if rows > 1 else 0)
+        tiles = []
+        for row in range(rows):
+            for col in range(cols):
+                left = max(int(x + col * tile_w - pad_w), x)
+                top = max(int(y + row * tile_h - pad_h), y)
+                right = min(int(math.ceil(x + (col + 1) * tile_w + pad_w)), x + w)
+                bottom = min(int(math.ceil(y + (row + 1) * tile_h + pad_h)), y + h)
+                tiles.append((left, top, right, bottom))
+
+        plan = {**density, "grid": grid, "tiles": tiles}
+        self._plans[key] = plan
+        return plan
+
+    def plan(self, key, image):
+        """
+        Get the plan for an image, computing it from the image itself if it was not registered
+
+        Args:
+            key: Image path or URL
+            image: Loaded PIL image
+
+        Returns:
+            Plan dictionary
+        """
+        if key not in self._plans:
+            gray = np.array(image.convert("L"))
+            self.register(key, enhance_image(gray))
+        return self._plans[key]
+
+    def prepare(self, key, image):
+        """
+        Crop an image into the model inputs chosen by the policy
+
+        Args:
+            key: Image path or URL
+            image: Loaded PIL image
+
+        Returns:
+            Tuple of (list of square PIL images in reading order, plan dictionary)
+        """
+        plan = self.plan(key, image)
+        image = image.convert("RGB")
+        return [pad_to_square(image.crop(box)) for box in plan["tiles"]], plan
+
+    def forget(self, key):
+        """Drop the stored plan for an image once it has been processed"""
+        self._plans.pop(key, None)
@@ -35,7 +35,13 @@ def enhance_prescription(image_path):
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Could not read image at {image_path}")
-        
+    
+    return enhance_image(img)
+
+def enhance_image(img):
+    """
+    Enhance an already loaded prescription image (BGR or grayscale array)
+    """
     # Normalize
     normalized = normalize_image(img)
     
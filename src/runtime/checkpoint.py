@@ -0,0 +1,180 @@
+# runtime/checkpoint.py
+
+import os
+import json
+import hashlib
+import tempfile
+from datetime import datetime
+
+# Content hash recorded for URL inputs that could not be downloaded
+UNFETCHED = "unfetched"
+
+def atomic_write_json(path, data):
+    """
+    Write JSON so readers only ever see the old or the complete new file
+
+    The data goes to a temporary file in the same directory, is flushed to
+    disk and then renamed over the target.
+
+    Args:
+        path: Destination file path
+        data: JSON-serializable object
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Content hash of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class RunManifest:
+    def __init__(self, output_dir, resume=False, max_attempts=3, filename="run_manifest.json", input_dir=None):
+        """
+        Tracks per-input progress of a batch run so it can be resumed
+
+        Args:
+            output_dir: Directory holding per-image results and the manifest
+            resume: Load the existing manifest instead of starting a new one
+            max_attempts: Number of times a failing input is tried before it is skipped
+            filename: Manifest file name inside output_dir
+            input_dir: Directory of local inputs; their entries are keyed relative to it so
+                a resume from another working directory finds them (optional)
+        """
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, filename)
+        self.max_attempts = max_attempts
+        self.input_dir = input_dir
+        self.entries = {}
+
+        if resume and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f).get("entries", {})
+            if input_dir:
+                self._rekey_legacy_entries()
+
+    def key(self, image_path):
+        """Manifest key of an input: URLs as given, local files relative to the input directory"""
+        if not self.input_dir or image_path.startswith(('http://', 'https://')):
+            return image_path
+        return os.path.relpath(os.path.abspath(image_path), os.path.abspath(self.input_dir))
+
+    def _rekey_legacy_entries(self):
+        """
+        Move entries keyed by the input path as typed to keys relative to the input directory
+
+        Older manifests stored the path as typed under --input_dir, which
+        depends on the working directory. Inputs are listed directly inside
+        the input directory, so the file name identifies them.
+        """
+        for old_key in list(self.entries):
+            if old_key.startswith(('http://', 'https://')):
+                continue
+            new_key = os.path.basename(old_key)
+            if new_key != old_key and new_key not in self.entries:
+                self.entries[new_key] = self.entries.pop(old_key)
+
+    def save(self):
+        """Atomically write the manifest"""
+        atomic_write_json(self.path, {"version": 1, "entries": self.entries})
+
+    def resolve_result_path(self, entry):
+        """
+        Absolute path of an entry's stored result, or None if it has none
+
+        Result paths are stored relative to the output directory so the
+        manifest stays valid when a run is resumed from another working
+        directory or the output directory is moved.
+        """
+        result_path = entry.get("result_path")
+        if not result_path:
+            return None
+        if os.path.isabs(result_path):
+            return result_path
+        resolved = os.path.join(os.path.abspath(self.output_dir), result_path)
+        if not os.path.exists(resolved) and os.path.exists(result_path):
+            # Manifests written before paths were made relative to the output directory
+            return os.path.abspath(result_path)
+        return resolved
+
+    def needs_processing(self, image_path, content_hash):
+        """
+        Decide whether an input still has to be processed
+
+        Args:
+            image_path: Input image path
+            content_hash: Current content hash of the input
+
+        Returns:
+            True if the input is new, changed, or failed fewer than max_attempts times
+        """
+        entry = self.entries.get(self.key(image_path))
+        if entry is None or entry["hash"] != content_hash:
+            return True
+        if entry["status"] == "completed":
+            result_path = self.resolve_result_path(entry)
+            return result_path is None or not os.path.exists(result_path)
+        return entry["attempts"] < self.max_attempts
+
+    def _update(self, image_path, content_hash, **fields):
+        """Merge fields into an entry, resetting it if the input content changed"""
+        key = self.key(image_path)
+        entry = self.entries.get(key)
+        if entry is None or entry["hash"] != content_hash:
+            entry = {"hash": content_hash, "attempts": 0, "result_path": None, "error": None}
+        entry.update(fields)
+        entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        self.entries[key] = entry
+        self.save()
+
+    def mark_completed(self, image_path, content_hash, result_path, position=None):
+        """Record that an input finished, where its result is stored and its position in the input list"""
+        attempts = self.entries.get(self.key(image_path), {}).get("attempts", 0)
+        result_path = os.path.relpath(os.path.abspath(result_path), os.path.abspath(self.output_dir))
+        self._update(image_path, content_hash, status="completed", result_path=result_path,
+                     attempts=attempts + 1, error=None, position=position)
+
+    def mark_failed(self, image_path, content_hash, error, position=None):
+        """Record a failed attempt for an input"""
+        entry = self.entries.get(self.key(image_path))
+        attempts = entry["attempts"] if entry and entry["hash"] == content_hash else 0
+        self._update(image_path, content_hash, status="failed", attempts=attempts + 1, error=str(error),
+                     position=position)
+
+    def load_results(self, image_paths):
+        """
+        Rebuild the list of results from the stored per-image files
+
+        Inputs without a completed result get an error record so the list
+        stays aligned with the input (and ground truth) order.
+
+        Args:
+            image_paths: Inputs in run order
+
+        Returns:
+            List of result dictionaries
+        """
+        results = []
+        for image_path in image_paths:
+            entry = self.entries.get(self.key(image_path))
+            result_path = self.resolve_result_path(entry) if entry else None
+            if entry and entry["status"] == "completed" and result_path and os.path.exists(result_path):
+                with open(result_path, 'r') as f:
+                    results.append(json.load(f))
+            else:
+                error = entry["error"] if entry else "Not processed"
+                results.append({"error": f"Processing failed: {error}", "source_image": image_path})
+        return results
@@ -0,0 +1,148 @@
+# runtime/http_fetch.py
+
+import os
+import json
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.runtime.checkpoint import atomic_write_json
+
+def is_url(path_or_url):
+    """Check whether an input refers to a remote image"""
+    return path_or_url.startswith(('http://', 'https://'))
+
+class ImageFetcher:
+    def __init__(self, cache_dir, max_workers=8, retries=3, backoff_factor=0.5, timeout=(5, 30)):
+        """
+        Pooled HTTP client with retries and an on-disk byte cache for URL inputs
+
+        Cached bytes are keyed by URL; when the server sent an ETag the cached
+        copy is revalidated with If-None-Match, so unchanged images are not
+        downloaded again across runs.
+
+        Args:
+            cache_dir: Directory for cached image bytes and their metadata
+            max_workers: Number of concurrent fetches (and pooled connections per host)
+            retries: Retries for connection errors and 429/5xx responses
+            backoff_factor: Exponential backoff factor between retries, in seconds
+            timeout: (connect, read) timeout in seconds
+        """
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        os.makedirs(cache_dir, exist_ok=True)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"])
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.stats = {'downloaded': 0, 'revalidated': 0, 'bytes': 0}
+
+    def _cache_paths(self, url):
+        """Local data and metadata paths for a URL"""
+        digest = hashlib.sha256(url.encode()).hexdigest()[:16]
+        name = os.path.basename(urlparse(url).path) or "image"
+        data_path = os.path.join(self.cache_dir, f"{digest}_{name}")
+        return data_path, data_path + ".meta.json"
+
+    def _url_lock(self, url):
+        """Per-URL lock so concurrent requests for one URL fetch it once"""
+        with self._locks_guard:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def fetch(self, url):
+        """
+        Fetch a URL into the cache
+
+        Args:
+            url: Image URL
+
+        Returns:
+            Local path of the cached image
+        """
+        data_path, meta_path = self._cache_paths(url)
+
+        with self._url_lock(url):
+            meta = None
+            if os.path.exists(data_path) and os.path.exists(meta_path):
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+
+            headers = {}
+            if meta is not None:
+                if not meta.get("etag"):
+                    # No validator to check against; the cached bytes are all we can use
+                    return data_path
+                headers["If-None-Match"] = meta["etag"]
+
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and meta is not None:
+                with self._locks_guard:
+                    self.stats['revalidated'] += 1
+                return data_path
+            response.raise_for_status()
+
+            tmp_path = data_path + ".part"
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, data_path)
+            atomic_write_json(meta_path, {"url": url, "etag": response.headers.get("ETag")})
+
+            with self._locks_guard:
+                self.stats['downloaded'] += 1
+                self.stats['bytes'] += len(response.content)
+
+        return data_path
+
+    def iter_prefetched(self, urls, depth=None):
+        """
+        Fetch URLs concurrently, keeping a bounded number in flight ahead of the consumer
+
+        Args:
+            urls: URLs in processing order
+            depth: Maximum fetches in flight or waiting to be consumed (defaults to 2 * max_workers)
+
+        Yields:
+            Tuples of (url, local path or None, exception or None), in input order
+        """
+        depth = depth or 2 * self.max_workers
+        pending = deque()
+        remaining = iter(urls)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for url in remaining:
+                pending.append((url, executor.submit(self.fetch, url)))
+                if len(pending) >= depth:
+                    break
+
+            while pending:
+                url, future = pending.popleft()
+                try:
+                    yield url, future.result(), None
+                except Exception as e:
+                    yield url, None, e
+
+                # Top up the window as the consumer advances
+                next_url = next(remaining, None)
+                if next_url is not None:
+                    pending.append((next_url, executor.submit(self.fetch, next_url)))
+
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
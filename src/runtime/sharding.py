@@ -0,0 +1,193 @@
+# runtime/sharding.py
+
+import os
+import glob
+import shutil
+import hashlib
+
+from src.runtime.checkpoint import RunManifest, atomic_write_json
+
+def parse_shard_spec(spec):
+    """
+    Parse a shard specification of the form "i/N"
+
+    Args:
+        spec: Shard string, e.g. "0/4"
+
+    Returns:
+        Tuple of (shard index, shard count)
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard specification '{spec}', expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard specification '{spec}', need 0 <= i < N")
+    return index, count
+
+def input_hash(image_path):
+    """
+    Deterministic hash of an input used for shard assignment
+
+    Hashes the file name rather than the full path, so nodes that mount the
+    corpus at different locations still agree on the split.
+    """
+    digest = hashlib.sha256(os.path.basename(image_path).encode()).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def shard_of(image_path, num_shards):
+    """Deterministic shard assignment for an input"""
+    return input_hash(image_path) % num_shards
+
+def select_shard(image_files, shard_index, num_shards, replica_index=0, num_replicas=1):
+    """
+    Pick the inputs belonging to one shard, or to one replica within it
+
+    Replicas split their node's shard further using the remaining hash bits,
+    so a node's inputs are the same whether or not it runs replicas, and
+    nodes with different replica counts still cover the corpus exactly once.
+
+    Args:
+        image_files: All inputs in run order
+        shard_index: Index of this shard
+        num_shards: Total number of shards
+        replica_index: Index of this replica within the shard
+        num_replicas: Number of replicas sharing the shard
+
+    Returns:
+        List of indices into image_files, in run order
+    """
+    selected = []
+    for i, path in enumerate(image_files):
+        value = input_hash(path)
+        if value % num_shards == shard_index and (value // num_shards) % num_replicas == replica_index:
+            selected.append(i)
+    return selected
+
+def parse_cpulist(cpulist):
+    """Parse a Linux cpulist string such as "0-3,8-11" into a list of CPU ids"""
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def get_numa_nodes():
+    """
+    CPUs available to this process grouped by NUMA node
+
+    Returns:
+        List of (node id, list of CPU ids); a single pseudo-node if the
+        topology is not exposed
+    """
+    available = set(os.sched_getaffinity(0))
+    nodes = []
+    for node_dir in sorted(glob.glob("/sys/devices/system/node/node[0-9]*"),
+                           key=lambda d: int(d.rsplit("node", 1)[-1])):
+        try:
+            with open(os.path.join(node_dir, "cpulist"), 'r') as f:
+                cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in available]
+        except OSError:
+            continue
+        if cpus:
+            nodes.append((int(node_dir.rsplit("node", 1)[-1]), cpus))
+
+    return nodes or [(None, sorted(available))]
+
+def plan_replicas(num_replicas):
+    """
+    Split the available CPUs into one set per replica, following NUMA nodes
+
+    CPUs are ordered node by node and cut into equal contiguous chunks, so
+    with one replica per node (or several per node) no replica spans sockets.
+
+    Args:
+        num_replicas: Number of model workers
+
+    Returns:
+        List of dictionaries with "cpus" and "numa_node" (None if the chunk spans nodes)
+    """
+    nodes = get_numa_nodes()
+    ordered = [(node, cpu) for node, cpus in nodes for cpu in cpus]
+    if num_replicas > len(ordered):
+        print(f"Warning: {num_replicas} replicas on {len(ordered)} CPUs, replicas will share cores")
+        return [{"cpus": [ordered[r % len(ordered)][1]], "numa_node": ordered[r % len(ordered)][0]}
+                for r in range(num_replicas)]
+
+    plans = []
+    chunk = len(ordered) / num_replicas
+    for r in range(num_replicas):
+        members = ordered[round(r * chunk):round((r + 1) * chunk)]
+        node_ids = {node for node, _ in members}
+        plans.append({
+            "cpus": [cpu for _, cpu in members],
+            "numa_node": node_ids.pop() if len(node_ids) == 1 else None
+        })
+    return plans
+
+def replica_command(base_command, plan):
+    """
+    Wrap a worker command so it runs pinned to its CPU set
+
+    Uses numactl to bind both CPUs and memory to the NUMA node when
+    available; otherwise the caller pins CPUs with sched_setaffinity.
+
+    Returns:
+        Tuple of (command list, whether CPU pinning is already handled)
+    """
+    if plan["numa_node"] is not None and shutil.which("numactl"):
+        cpus = ",".join(str(cpu) for cpu in plan["cpus"])
+        return ["numactl", f"--physcpubind={cpus}", f"--membind={plan['numa_node']}"] + base_command, True
+    return base_command, False
+
+def shard_dir_name(shard_index, num_shards, replica_index=0, num_replicas=1):
+    """Name of the output subdirectory for a shard or one of its replicas"""
+    name = f"shard_{shard_index}_of_{num_shards}"
+    if num_replicas > 1:
+        name += f"_replica_{replica_index}_of_{num_replicas}"
+    return name
+
+def merge_shard_outputs(shard_dirs, output_dir):
+    """
+    Combine per-shard manifests and results into one output directory
+
+    Args:
+        shard_dirs: Output directories of the individual shards
+        output_dir: Directory for the merged all_results.json and manifest
+
+    Returns:
+        Tuple of (input paths in run order, merged results, positions in the full input list;
+        None for entries written before positions were recorded)
+    """
+    merged = RunManifest(output_dir)
+    for shard_dir in shard_dirs:
+        if not os.path.exists(os.path.join(shard_dir, "run_manifest.json")):
+            print(f"Warning: No run manifest in {shard_dir}, skipping")
+            continue
+        shard = RunManifest(shard_dir, resume=True)
+        for image_path, entry in shard.entries.items():
+            # Results stay in the shard directory; point at them relative to the merged output
+            result_path = shard.resolve_result_path(entry)
+            if result_path:
+                entry["result_path"] = os.path.relpath(result_path, os.path.abspath(output_dir))
+            merged.entries[image_path] = entry
+
+    # Same order as an unsharded run: input list position where recorded, file name otherwise
+    image_files = sorted(
+        merged.entries,
+        key=lambda path: (merged.entries[path].get("position") is None,
+                          merged.entries[path].get("position") or 0,
+                          os.path.basename(path))
+    )
+    merged.save()
+
+    results = merged.load_results(image_files)
+    atomic_write_json(os.path.join(output_dir, "all_results.json"), results)
+
+    positions = [merged.entries[path].get("position") for path in image_files]
+    return image_files, results, positions